@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Benchmarks inventory, read and write throughput against the simulator, and
+# some of the CPU-bound helpers. Results are written as JSON so successive
+# runs can be compared:
+#
+#   python benchmark.py -o before.json
+#   python benchmark.py -o after.json --latency 0.002
+
+from __future__ import print_function
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from rfidgeek import PyRFIDGeek, CRC, DanishRecord, ISO15693, __version__
+from rfidgeek import danish
+from rfidgeek.frame import parse_records
+from rfidgeek.rfidgeek import flagsbyte, decode_danish_model
+from rfidgeek.simulator import SimulatedReader, make_population
+
+POPULATIONS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    def p(q):
+        return samples[min(n - 1, int(q * n))] * 1000.0
+
+    return {'p50_ms': p(0.50), 'p90_ms': p(0.90), 'p99_ms': p(0.99), 'max_ms': samples[-1] * 1000.0}
+
+
+def reader_for(tags, args):
+    sim = SimulatedReader(tags, seed=args.seed, latency=args.latency)
+    reader = PyRFIDGeek(serial_port=None, transport=sim)
+    reader.set_protocol(ISO15693)
+    return sim, reader
+
+
+def measure(sim, repeat, func):
+    # Calls func() `repeat` times, returning the timings, the number of
+    # frames sent per call and the total number of items func() returned
+    timings = []
+    items = 0
+    frames = sim.frames
+    for i in range(repeat):
+        started = monotonic()
+        items += func(i)
+        timings.append(monotonic() - started)
+    return timings, (sim.frames - frames) / float(repeat), items
+
+
+def bench_inventory(args):
+    results = []
+    for n in POPULATIONS:
+        sim, reader = reader_for(make_population(n, seed=args.seed), args)
+        timings, frames, tags = measure(sim, args.repeat,
+                                        lambda i: len(list(reader.inventory(anticollision=True))))
+        result = {'tags': n, 'tags_per_s': tags / sum(timings), 'frames_per_op': frames}
+        result.update(percentiles(timings))
+        results.append(result)
+        print('inventory %3d tags: %8.0f tags/s' % (n, result['tags_per_s']), file=sys.stderr)
+    return results
+
+
+def bench_read(args):
+    tags = make_population(args.tags, seed=args.seed)
+    sim, reader = reader_for(tags, args)
+    timings, frames, _ = measure(sim, args.repeat * len(tags),
+                                 lambda i: reader.read_danish_model_tag(tags[i % len(tags)].uid) and 1)
+    result = {'reads_per_s': len(timings) / sum(timings), 'frames_per_op': frames}
+    result.update(percentiles(timings))
+    print('read: %8.0f reads/s' % result['reads_per_s'], file=sys.stderr)
+    return result
+
+
+def bench_write(args):
+    tags = make_population(args.tags, seed=args.seed, blank=args.tags)
+    sim, reader = reader_for(tags, args)
+
+    def write(i):
+        uid = tags[i % len(tags)].uid
+        return reader.write_danish_model_tag(uid, {'id': '%09d' % i, 'partno': 1, 'nparts': 1,
+                                                   'country': 'NO', 'library': '1030310'}) and 1
+
+    timings, frames, _ = measure(sim, args.repeat * len(tags), write)
+    result = {'cards_per_s': len(timings) / sum(timings), 'frames_per_op': frames}
+    result.update(percentiles(timings))
+    print('write: %8.0f cards/s' % result['cards_per_s'], file=sys.stderr)
+    return result
+
+
+def bench_cpu(args):
+    crc = CRC()
+    data = list(range(30))
+    inventory_reply = b''.join(b'[E004010012345%03X,5A]\r\n' % i for i in range(16))
+    record = DanishRecord('123456789', 'NO', '1030310')
+    memory = bytearray(b'\x11\x01\x01' + b'123456789' + b'\x00' * 7 + b'\x00\x00NO1030310' + b'\x00' * 4)
+
+    benchmarks = {
+        'crc_calculate': lambda: crc.calculate(data),
+        'flagsbyte': lambda: flagsbyte(inventory=True, single_slot=True),
+        'parse_records': lambda: parse_records(inventory_reply),
+        'decode_danish_model': lambda: decode_danish_model('E004010012345678', memory),
+        'danish_encode': lambda: danish.encode(record),
+    }
+    results = {}
+    for name, func in sorted(benchmarks.items()):
+        number = args.number
+        best = min(timeit.repeat(func, number=number, repeat=3))
+        results[name] = {'ops_per_s': number / best, 'us_per_op': best / number * 1e6}
+        print('%s: %.2f us/op' % (name, results[name]['us_per_op']), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pyrfidgeek against the simulator')
+    parser.add_argument('-o', '--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated reply latency in seconds')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions of each operation')
+    parser.add_argument('--tags', type=int, default=16, help='tags in the field for read/write benchmarks')
+    parser.add_argument('--number', type=int, default=10000, help='iterations of CPU benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'settings': dict((k, v) for k, v in vars(args).items() if k != 'output'),
+        'inventory': bench_inventory(args),
+        'read': bench_read(args),
+        'write': bench_write(args),
+        'cpu': bench_cpu(args),
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
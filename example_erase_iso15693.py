@@ -18,7 +18,9 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
-rfid = PyRFIDGeek(serial_port=COM_PORT_NAME, debug=True)
+# Log all frames sent and received
+logging.getLogger('rfidgeek').setLevel(logging.DEBUG)
+rfid = PyRFIDGeek(serial_port=COM_PORT_NAME)
 rfid.set_protocol(ISO15693)
 uids = list(rfid.inventory())
 if len(uids) == 1:
@@ -1,27 +1,22 @@
 from __future__ import print_function
 import yaml
-from rfidgeek import PyRFIDGeek, ISO14443A, ISO15693
+from rfidgeek import PyRFIDGeek, ProtocolScanner, ISO14443A, ISO14443B, ISO15693
 
 # You might need to change this:
 COM_PORT_NAME = '/dev/tty.SLAB_USBtoUART'
 
-reader = PyRFIDGeek(serial_port=COM_PORT_NAME, debug=True)
+reader = PyRFIDGeek(serial_port=COM_PORT_NAME)
 
-protocols = [ISO14443A, ISO15693]
+# Item tags (ISO 15693) get most of the airtime, but patron cards (ISO 14443)
+# are looked for at least once a second
+scanner = ProtocolScanner(reader,
+                          weights={ISO15693: 10, ISO14443A: 1, ISO14443B: 1},
+                          revisit={ISO14443A: 1.0, ISO14443B: 1.0})
 
 try:
-    while True:
-        tags = {protocol: set() for protocol in protocols}
-
-        for protocol in protocols:
-            reader.set_protocol(protocol)
-            for uid in reader.inventory():
-                tags[protocol].add(uid)
-
-        tags2 = ['{} ({})'.format(tag, protocol) for protocol in protocols for tag in tags[protocol]]
-        total_tags = len(tags[ISO14443A]) + len(tags[ISO15693])
-
-        print('Found %d tag(s): %s' % (total_tags, ', '.join(tags2)))
+    for protocol, uids in scanner.scan():
+        if uids:
+            print('Found %d %s tag(s): %s' % (len(uids), protocol, ', '.join(uids)))
 
 finally:
     print('Bye!')
@@ -4,10 +4,8 @@ from __future__ import print_function
 import logging
 import argparse
 import yaml
-import time
-from copy import copy
 
-from rfidgeek import PyRFIDGeek, ISO15693
+from rfidgeek import PyRFIDGeek, PresenceTracker, AdaptivePoller, ARRIVED, ISO15693
 
 # You might need to change this:
 COM_PORT_NAME = '/dev/tty.SLAB_USBtoUART'
@@ -18,56 +16,62 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
-reader = PyRFIDGeek(serial_port=COM_PORT_NAME, debug=True)
+# Log all frames sent and received
+logging.getLogger('rfidgeek').setLevel(logging.DEBUG)
+reader = PyRFIDGeek(serial_port=COM_PORT_NAME)
 
 reader.set_protocol(ISO15693)
 
 try:
 
     led_enabled = False
-    uids = []
-    prev_uids = [[], []]
+    # Tags must miss two polls in a row before they're considered gone, so
+    # tags that miss a single poll aren't reported as new
+    presence = PresenceTracker(reader, max_misses=2)
+    # Poll fast while tags come and go, and slow down while nothing happens
+    poller = AdaptivePoller(min_interval=0.1, max_interval=2.0)
     while True:
-        uids = list(reader.inventory())
-        successful_reads = []
-        print('%d tags' % len(uids))
-        if len(uids) > 0 and not led_enabled:
+        events = presence.poll()
+        poller.update(bool(events), present=len(presence) > 0)
+        print('%d tags' % len(presence))
+        if len(presence) > 0 and not led_enabled:
             reader.enable_led(3)
             led_enabled = True
-        elif len(uids) == 0 and led_enabled:
+        elif len(presence) == 0 and led_enabled:
             reader.disable_led(3)
             led_enabled = False
-        for uid in uids:
+        for event in events:
+            if event.event != ARRIVED:
+                continue
+            uid = event.uid
 
-            if uid not in prev_uids[0] and uid not in prev_uids[1]:  # and not uid in prev_uids[2]:
-                item = reader.read_danish_model_tag(uid)
-                if item['error'] != '':
-                    print('error reading tag: ', item['error'])
-                else:
-                    if item['is_blank']:
-                        print(' Found blank tag')
+            # Tags that have been away for a while are usually still in the
+            # reader's tag cache, so they don't have to be read again.
+            item = reader.read_danish_model_tag(uid, cached=True)
+            if item['error'] != '':
+                print('error reading tag: ', item['error'])
+                # Try again on the next poll
+                presence.forget(uid)
+            else:
+                if item['is_blank']:
+                    print(' Found blank tag')
 
-                    elif 'id' in item:
-                        print
-                        print(' Found new tag, usage type: %s' % item['usage_type'])
-                        print(' # Item id: %s (part %d of %d)' % (item['id'],
-                                                                  item['partno'],
-                                                                  item['nparts']))
-                        print('   Country: %s, library: %s' % (item['country'],
-                                                               item['library']))
-                        if item['crc_ok']:
-                            print('   CRC check successful')
-                            successful_reads.append(uid)
-                        else:
-                            print('   CRC check failed')
+                elif 'id' in item:
+                    print()
+                    print(' Found new tag, usage type: %s' % item['usage_type'])
+                    print(' # Item id: %s (part %d of %d)' % (item['id'],
+                                                              item['partno'],
+                                                              item['nparts']))
+                    print('   Country: %s, library: %s' % (item['country'],
+                                                           item['library']))
+                    if item['crc_ok']:
+                        print('   CRC check successful')
+                    else:
+                        print('   CRC check failed')
 
             # reader.unlock_afi(uid)
 
-        # prev_uids[2] = copy(prev_uids[1])
-        prev_uids[1] = copy(prev_uids[0])
-        prev_uids[0] = copy(uids)
-
-        time.sleep(1)
+        poller.wait()
 
 finally:
     reader.close()
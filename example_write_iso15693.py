@@ -26,8 +26,11 @@ ch.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
 
+# Log all frames sent and received
+logging.getLogger('rfidgeek').setLevel(logging.DEBUG)
+
 try:
-    reader = PyRFIDGeek(serial_port=COM_PORT_NAME, debug=True)
+    reader = PyRFIDGeek(serial_port=COM_PORT_NAME)
 except serial.serialutil.SerialException:
     print("Failed to open serial port " + config['serial']['port'])
     sys.exit(1)
@@ -1,6 +1,17 @@
 import logging
-from .rfidgeek import PyRFIDGeek, ISO14443A, ISO14443B, ISO15693
-from .crc import CRC
+from .rfidgeek import PyRFIDGeek, TagInfo, ISO14443A, ISO14443B, ISO15693, AFI_SECURED, AFI_UNSECURED
+from .crc import CRC, crc_ccitt, danish_model_crc, danish_model_crcs
+from .danish import DanishRecord
+from .cache import LRUCache, TTLCache
+from .presence import PresenceTracker, ARRIVED, DEPARTED, STILL_PRESENT
+from .scheduler import CommandScheduler, PRIORITY_USER, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from .pool import ReaderPool
+from .simulator import SimulatedReader, SimulatedTag, make_population
+from .capture import CaptureTransport, ReplayTransport, read_capture
+from .metrics import Metrics
+from .polling import AdaptivePoller
+from .scan import ProtocolScanner
+from .parts import PartAggregator, COMPLETE, INCOMPLETE
 
 import pkg_resources  # part of setuptools
 __version__ = pkg_resources.require('rfidgeek')[0].version
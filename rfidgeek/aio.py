@@ -0,0 +1,229 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# asyncio version of PyRFIDGeek (Python 3.6+).
+#
+# Opening a serial port requires pyserial-asyncio (pip install pyserial-asyncio),
+# but any pair of asyncio streams can be used, see AsyncPyRFIDGeek.__init__.
+
+import asyncio
+import binascii
+import logging
+import struct
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+from .frame import (build_frame, build_iso15693_frame, encode_frame, parse_records,
+                    record_payload, reply_complete, FLAGS_ADDRESSED,
+                    CMD_ISO15693_INVENTORY, CMD_ISO15693_REQUEST, CMD_ISO14443A_ANTICOLLISION,
+                    CMD_ISO14443B_REQUEST)
+from .rfidgeek import (ISO15693, ISO14443A, ISO14443B, CHIP_STATUS_CONTROL, ISO_CONTROL, ISO_CONTROL_VALUES,
+                       LED_ON_COMMANDS, LED_OFF_COMMANDS, ISO15693Inventory,
+                       decode_danish_model, iso14443a_uid, iso14443b_pupi)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPyRFIDGeek(object):
+    """
+    Coroutine version of PyRFIDGeek:
+
+        rfid = await AsyncPyRFIDGeek.open('/dev/tty.SLAB_USBtoUART')
+        await rfid.set_protocol(ISO15693)
+        async for uids in rfid.scan(interval=0.2):
+            for uid in uids:
+                item = await rfid.read_danish_model_tag(uid)
+
+    Commands are serialized with a lock, so the object can be shared by
+    several tasks.
+    """
+
+    def __init__(self, reader, writer, timeout=0.1, idle_timeout=0.005):
+        """
+        `reader` and `writer` are an asyncio StreamReader/StreamWriter pair
+        connected to the board. See PyRFIDGeek for `timeout` and
+        `idle_timeout`.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.lock = asyncio.Lock()
+
+        self.protocol = None
+        self._initialized = False
+        self.registers = {}
+
+        # Statistics for the last ISO 15693 inventory
+        self.inventory_stats = None
+
+    @classmethod
+    async def open(cls, serial_port, serial_baud_rate=115200, **kwargs):
+        """
+        Opens the serial port using pyserial-asyncio.
+        """
+        if serial_asyncio is None:
+            raise ImportError('Please install pyserial-asyncio to open serial ports with asyncio')
+        reader, writer = await serial_asyncio.open_serial_connection(url=serial_port,
+                                                                     baudrate=serial_baud_rate)
+        return cls(reader, writer, **kwargs)
+
+    async def close(self):
+        self.writer.close()
+        if hasattr(self.writer, 'wait_closed'):
+            await self.writer.wait_closed()
+
+    async def set_protocol(self, protocol=ISO15693, force=False):
+        """
+        See PyRFIDGeek.set_protocol(). Only the register writes that change
+        the reader state are sent.
+        """
+        if force:
+            self._initialized = False
+            self.registers = {}
+        if not self._initialized:
+            await self.transceive(0xFF)
+            await self.transceive(0xF0, b'\x00')    # AGC enable
+            await self.transceive(0xF1, b'\xFF')    # AM input
+            self._initialized = True
+        changed = [(addr, value) for addr, value in ((CHIP_STATUS_CONTROL, '21'),
+                                                     (ISO_CONTROL, ISO_CONTROL_VALUES[protocol]))
+                   if self.registers.get(addr) != value]
+        if changed:
+            await self.transceive(0x10, binascii.unhexlify(''.join(a + v for a, v in changed)))
+            self.registers.update(changed)
+        self.protocol = protocol
+
+    async def enable_led(self, led_no):
+        await self.transceive(int(LED_ON_COMMANDS[led_no], 16))
+
+    async def disable_led(self, led_no):
+        await self.transceive(int(LED_OFF_COMMANDS[led_no], 16))
+
+    async def inventory(self, **kwargs):
+        """
+        Returns the list of UIDs found. See iter_inventory().
+        """
+        return [uid async for uid in self.iter_inventory(**kwargs)]
+
+    async def iter_inventory(self, single_slot=False, anticollision=False, afi=None, mask=0, mask_length=0):
+        """
+        Async generator yielding the UIDs found by an inventory using the
+        current protocol. See PyRFIDGeek.inventory_iso15693() for the
+        arguments. As there, statistics for the last ISO 15693 inventory are
+        kept in `inventory_stats`.
+        """
+        if self.protocol == ISO14443A:
+            for record in await self.transceive(CMD_ISO14443A_ANTICOLLISION, expected_records=None):
+                uid = iso14443a_uid(record)
+                if uid is not None:
+                    yield uid
+            return
+        if self.protocol == ISO14443B:
+            for record in await self.transceive(CMD_ISO14443B_REQUEST, b'\x00\x00', expected_records=None):
+                pupi = iso14443b_pupi(record)
+                if pupi is not None:
+                    yield pupi
+            return
+        if self.protocol != ISO15693:
+            return
+
+        inventory = ISO15693Inventory(single_slot, anticollision, afi, mask, mask_length)
+        self.inventory_stats = inventory.stats
+        for data in inventory.requests():
+            records = await self.transceive_iso15693(CMD_ISO15693_INVENTORY,
+                                                     inventory.flags_value,
+                                                     0x01,
+                                                     data,
+                                                     expected_records=inventory.expected_records)
+            for uid in inventory.handle(records):
+                yield uid
+
+    async def scan(self, interval=0.5, **kwargs):
+        """
+        Async generator running an inventory every `interval` seconds and
+        yielding the list of UIDs found each time.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            yield await self.inventory(**kwargs)
+            await asyncio.sleep(max(0, interval - (loop.time() - started)))
+
+    async def read_danish_model_tag(self, uid, block_size=4):
+        """
+        See PyRFIDGeek.read_danish_model_tag().
+        """
+        nblocks = 32 // block_size
+        records = await self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                                 FLAGS_ADDRESSED,
+                                                 0x23,
+                                                 binascii.unhexlify(uid) + struct.pack('BB', 0, nblocks - 1))
+        if not records or records[0] == b'':
+            return {'error': 'read-failed'}
+        elif records[0] == b'z':
+            return {'error': 'tag-conflict'}
+        payload = record_payload(records[0])
+        if payload[0] != 0:
+            return {'error': 'read-failed'}
+        return decode_danish_model(uid, payload[1:])
+
+    async def write_block(self, uid, block_number, data):
+        """
+        Writes a single block. `data` is either bytes or, as for
+        PyRFIDGeek.write_block(), a list of two-digit hex strings.
+        Returns True on success.
+        """
+        if isinstance(data, list):
+            data = binascii.unhexlify(''.join(data))
+        records = await self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                                 FLAGS_ADDRESSED,
+                                                 0x21,
+                                                 binascii.unhexlify(uid) + struct.pack('B', block_number) + bytes(data))
+        return bool(records) and records[0] == b'00'
+
+    async def transceive(self, cmd, prms=b'', expected_records=0):
+        """
+        Sends EVM command `cmd` (int) with parameters `prms` (bytes) and
+        returns the records of the reply as a list of bytes.
+        """
+        return await self.transceive_frame(build_frame(cmd, prms), expected_records)
+
+    async def transceive_iso15693(self, cmd, flags_value, command_code, data=b'', expected_records=1):
+        return await self.transceive_frame(build_iso15693_frame(cmd, flags_value, command_code, data),
+                                           expected_records)
+
+    async def transceive_frame(self, frame, expected_records=0):
+        async with self.lock:
+            msg = encode_frame(frame)
+            logger.debug('SEND%3d: %s', len(frame), msg)
+            self.writer.write(msg)
+            await self.writer.drain()
+            reply = await self.read(expected_records)
+            logger.debug('RETR%3d: %r', len(reply), reply)
+        return parse_records(reply)
+
+    async def read(self, expected_records=None):
+        """
+        Reads a reply, returning as soon as it is complete.
+        See PyRFIDGeek.read() for the meaning of `expected_records`.
+        """
+        buf = bytearray()
+        while True:
+            if expected_records == 0 and buf.endswith(b'\n'):
+                wait = self.idle_timeout
+            else:
+                wait = self.timeout
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(1024), wait)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break   # EOF
+            buf += chunk
+            if expected_records and reply_complete(buf, expected_records):
+                break
+        return bytes(buf)
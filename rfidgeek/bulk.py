@@ -0,0 +1,254 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Bulk pre-encoding of Danish data model tag images from item lists.
+#
+#   python -m rfidgeek.bulk items.csv -o images.csv --errors errors.csv
+#
+# Input is CSV with a header row, or JSON Lines (one object per line), with
+# the columns/keys
+#   id                  item id (required)
+#   country, library    owner library, or
+#   isil                owner library as an ISIL, e.g. NO-1030310
+#   partno, nparts      optional, default 1
+#
+# The output CSV has the columns id, partno, nparts and image (the 32-byte
+# tag image as hex, CRC included), ready for PyRFIDGeek.write_danish_model_tag().
+# With --binary, the images are written back to back instead.
+#
+# Items are read, validated and encoded in chunks spread over a process
+# pool, with a bounded number of chunks in flight, so memory use doesn't
+# grow with the size of the input.
+
+from __future__ import print_function
+import argparse
+import binascii
+import csv
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import sys
+from collections import deque
+
+from .danish import DanishRecord, encode_many
+from .crc import RECORD_SIZE
+
+logger = logging.getLogger(__name__)
+
+try:
+    TEXT_TYPES = (basestring, int, long)
+except NameError:
+    # Python 3
+    TEXT_TYPES = (str, int)
+
+
+def _open_text(path, mode):
+    # csv wants text files with newline='' on Python 3, and byte files on Python 2
+    if sys.version_info[0] >= 3:
+        return io.open(path, mode, newline='', encoding='utf-8')
+    return open(path, mode + 'b')
+
+
+def read_items(path, fmt=None):
+    """
+    Generator yielding (line number, dict) for the items in a CSV or JSON
+    Lines file. The format is guessed from the file extension unless given.
+    """
+    if fmt is None:
+        fmt = 'json' if path.endswith(('.json', '.jsonl', '.ndjson')) else 'csv'
+    with _open_text(path, 'r') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if line:
+                    try:
+                        yield lineno, json.loads(line)
+                    except ValueError as e:
+                        yield lineno, {'_error': 'Invalid JSON: %s' % e}
+
+
+def _text(item, key):
+    # Text field; numbers (common for ids in JSON exports) are converted
+    value = item.get(key)
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, TEXT_TYPES):
+        raise ValueError('%s is not a string: %r' % (key, value))
+    if not isinstance(value, TEXT_TYPES[0]):
+        value = str(value)
+    return value.strip()
+
+
+def _int(item, key):
+    value = item.get(key)
+    if value in (None, ''):
+        return 1
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('%s is not a number: %r' % (key, value))
+
+
+def validate(item):
+    """
+    Returns a DanishRecord for the item (a dict, see the module docs), or
+    raises ValueError explaining what is wrong with it.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Expected an object, got %r' % (item,))
+    if item.get('_error'):
+        raise ValueError(item['_error'])
+    itemid = _text(item, 'id')
+    if not itemid:
+        raise ValueError('Missing item id')
+    if len(itemid.encode('latin-1', 'replace')) > 16:
+        raise ValueError('Item id longer than 16 characters: %r' % itemid)
+
+    isil = _text(item, 'isil')
+    if isil:
+        country, _, library = isil.partition('-')
+    else:
+        country = _text(item, 'country')
+        library = _text(item, 'library')
+    if len(country) != 2 or not country.isalpha() or not country.isupper():
+        raise ValueError('Invalid country code: %r' % country)
+    if not library or len(library) > 9:
+        raise ValueError('Invalid library: %r' % library)
+
+    partno = _int(item, 'partno')
+    nparts = _int(item, 'nparts')
+    if not 1 <= nparts <= 255:
+        raise ValueError('Number of parts must be 1-255: %d' % nparts)
+    if not 1 <= partno <= nparts:
+        raise ValueError('Part number must be 1-%d: %d' % (nparts, partno))
+
+    try:
+        itemid.encode('latin-1')
+        library.encode('latin-1')
+    except UnicodeError:
+        raise ValueError('Characters outside Latin-1 in %r/%r' % (itemid, library))
+    return DanishRecord(itemid, country, library, partno, nparts)
+
+
+def encode_chunk(items):
+    """
+    Validates and encodes a list of (line number, item) pairs. Returns a
+    list of (line number, DanishRecord or None, image or None, error).
+    """
+    results = []
+    records = []
+    for lineno, item in items:
+        try:
+            record = validate(item)
+        except ValueError as e:
+            results.append((lineno, None, None, str(e)))
+        else:
+            records.append(record)
+            results.append((lineno, record, None, None))
+
+    images = encode_many(records)
+    i = 0
+    for n, (lineno, record, _, error) in enumerate(results):
+        if record is not None:
+            results[n] = (lineno, record, images[i * RECORD_SIZE:(i + 1) * RECORD_SIZE], None)
+            i += 1
+    return results
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_items(items, processes=None, chunksize=1000, max_pending=None):
+    """
+    Generator validating and encoding (line number, item) pairs, yielding
+    (line number, DanishRecord or None, image or None, error) in input
+    order. With processes=1 everything runs in this process, otherwise the
+    chunks are spread over a process pool, with at most `max_pending`
+    chunks (default: twice the number of processes) in flight.
+    """
+    if processes == 1:
+        for chunk in _chunks(items, chunksize):
+            for result in encode_chunk(chunk):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    if max_pending is None:
+        max_pending = 2 * (processes or multiprocessing.cpu_count())
+    pending = deque()
+    try:
+        for chunk in _chunks(items, chunksize):
+            pending.append(pool.apply_async(encode_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-encode Danish data model tag images')
+    parser.add_argument('input', help='CSV or JSON Lines file with the items')
+    parser.add_argument('-o', '--output', required=True, help='output file')
+    parser.add_argument('--format', choices=['csv', 'json'], help='input format (default: from extension)')
+    parser.add_argument('--binary', action='store_true', help='write the images back to back')
+    parser.add_argument('--errors', help='write invalid rows to this CSV file')
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--chunksize', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    ok = failed = 0
+    errors_file = errors = None
+    if args.errors:
+        errors_file = _open_text(args.errors, 'w')
+        errors = csv.writer(errors_file)
+        errors.writerow(['line', 'error'])
+    if args.binary:
+        out_file = open(args.output, 'wb')
+    else:
+        out_file = _open_text(args.output, 'w')
+        out = csv.writer(out_file)
+        out.writerow(['id', 'partno', 'nparts', 'image'])
+    try:
+        results = encode_items(read_items(args.input, args.format), args.processes, args.chunksize)
+        for lineno, record, image, error in results:
+            if error is not None:
+                failed += 1
+                logger.warn('Line %d: %s', lineno, error)
+                if errors is not None:
+                    errors.writerow([lineno, error])
+            elif args.binary:
+                ok += 1
+                out_file.write(image)
+            else:
+                ok += 1
+                out.writerow([record.id, record.partno, record.nparts,
+                              binascii.hexlify(image).decode('ascii').upper()])
+    finally:
+        out_file.close()
+        if errors_file is not None:
+            errors_file.close()
+
+    print('%d images written, %d invalid items' % (ok, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Recording and replay of the serial traffic between PyRFIDGeek and a board.
+#
+#   rfid = PyRFIDGeek('/dev/ttyUSB0', capture='session.cap')   # record
+#   rfid = PyRFIDGeek(None, transport=ReplayTransport('session.cap'))
+#
+# Capture file format: the magic string below, followed by records of
+#   timestamp (float64, seconds since the session started, monotonic clock)
+#   direction (1 byte: S = session start, W = written, R = read)
+#   length (uint32)
+#   data
+# all little-endian. Files are only ever appended to, so several sessions
+# can be recorded to the same file.
+
+import logging
+import os
+import struct
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from .transport import QueuedTransport
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RFIDGEEK-CAPTURE-1\n'
+RECORD_HEADER = struct.Struct('<dcI')
+
+SESSION = b'S'
+WRITE = b'W'
+READ = b'R'
+
+
+def read_capture(path):
+    """
+    Generator yielding the records of a capture file as
+    (timestamp, direction, data) tuples.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a capture file' % path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break   # end of file, or a record cut short by a crash
+            timestamp, direction, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, direction, data
+
+
+class CaptureTransport(object):
+    """
+    Wraps a serial port (or any transport), recording everything written to
+    and read from it to the capture file at `path`.
+    """
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if new:
+            self.file.write(MAGIC)
+        self.started = monotonic()
+        self._record(SESSION, b'')
+
+    def _record(self, direction, data):
+        self.file.write(RECORD_HEADER.pack(monotonic() - self.started, direction, len(data)))
+        self.file.write(data)
+        # Captures are most useful after a crash, so don't keep anything
+        # in the buffer
+        self.file.flush()
+
+    @property
+    def portstr(self):
+        return getattr(self.transport, 'portstr', None)
+
+    @property
+    def in_waiting(self):
+        return self.transport.in_waiting
+
+    def read(self, size=1):
+        data = self.transport.read(size)
+        if data:
+            self._record(READ, data)
+        return data
+
+    def readall(self):
+        data = self.transport.readall()
+        if data:
+            self._record(READ, data)
+        return data
+
+    def write(self, msg):
+        self._record(WRITE, bytes(msg))
+        return self.transport.write(msg)
+
+    def close(self):
+        self.file.close()
+        self.transport.close()
+
+
+class ReplayTransport(QueuedTransport):
+    """
+    Serial port stand-in that feeds a capture back to PyRFIDGeek. Each write
+    releases the data read after the corresponding write in the capture,
+    either as fast as possible or, with `realtime=True`, with the recorded
+    delays (divided by `speed`).
+
+    Writes are expected to match the capture; mismatches are logged, or
+    raise ValueError if `strict` is set.
+    """
+
+    def __init__(self, path, realtime=False, speed=1.0, strict=False):
+        super(ReplayTransport, self).__init__()
+        self.records = [r for r in read_capture(path) if r[1] != SESSION]
+        self.realtime = realtime
+        self.speed = speed
+        self.strict = strict
+        self.portstr = 'replay://' + path
+        self.mismatches = 0
+        self._pos = 0
+        self._queue_reads(monotonic(), None)
+
+    @property
+    def done(self):
+        return self._pos >= len(self.records) and not self._pending and not self._buffer
+
+    def _queue_reads(self, now, written_at):
+        # Queues the read records up to the next write
+        while self._pos < len(self.records) and self.records[self._pos][1] == READ:
+            timestamp, _, data = self.records[self._pos]
+            delay = 0.0
+            if self.realtime and written_at is not None:
+                delay = max(0.0, timestamp - written_at) / self.speed
+            self._queue(data, now + delay)
+            self._pos += 1
+
+    def write(self, msg):
+        if self._pos >= len(self.records):
+            raise EOFError('End of capture')
+        timestamp, _, expected = self.records[self._pos]
+        self._pos += 1
+        if bytes(msg) != expected:
+            self.mismatches += 1
+            if self.strict:
+                raise ValueError('Expected %r, got %r' % (expected, msg))
+            logger.warn('Replay mismatch: expected %r, got %r', expected, msg)
+        self._queue_reads(monotonic(), timestamp)
+        return len(msg)
+
+    def close(self):
+        pass
@@ -12,29 +12,115 @@
 # RFID Data model for libraries : Doc 067 (July 2005), p. 51
 # <http://www.biblev.no/RFID/dansk_rfid_datamodel.pdf>
 
+try:
+    # Use NumPy to vectorize batch calculations if it is available
+    import numpy
+except ImportError:
+    numpy = None
+
+CRC_POLY = 0x1021
+CRC_INIT = 0xffff
+
+# Size of a Danish data model record, and the position of the CRC within it
+RECORD_SIZE = 32
+CRC_OFFSET = 19
+
+
+def _make_table(poly):
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ poly) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _make_table(CRC_POLY)
+
+
+def crc_ccitt(data, crc=CRC_INIT):
+    """
+    Returns the CRC-CCITT of `data` (bytes, bytearray, memoryview or a
+    sequence of ints) as an int. Pass the result of a previous call as `crc`
+    to continue a calculation.
+    """
+    table = CRC_TABLE
+    for c in bytearray(data):
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ c]
+    return crc
+
+
+def _danish_model_message(record):
+    # The 19 bytes before the CRC, the 11 bytes after it, and two zero bytes
+    # to make up for the skipped CRC bytes
+    record = memoryview(record)
+    return record[:CRC_OFFSET].tobytes() + record[CRC_OFFSET + 2:RECORD_SIZE].tobytes() + b'\0\0'
+
+
+def danish_model_crc(record):
+    """
+    Returns the CRC of a 32-byte Danish data model record as an int. The
+    CRC bytes in the record itself are skipped. Note that the CRC is stored
+    in the record least significant byte first.
+    """
+    return crc_ccitt(_danish_model_message(record))
+
+
+def danish_model_crcs(records):
+    """
+    Calculates the CRCs of many Danish data model records at once.
+    `records` is either a bytes-like object holding the records back to back,
+    or an iterable of 32-byte records. Returns a list of ints.
+    """
+    if isinstance(records, (bytes, bytearray, memoryview)):
+        buf = memoryview(records)
+    else:
+        buf = memoryview(b''.join(bytes(r) for r in records))
+    if len(buf) % RECORD_SIZE:
+        raise ValueError('Buffer length %d is not a multiple of %d' % (len(buf), RECORD_SIZE))
+
+    if numpy is None:
+        return [danish_model_crc(buf[i:i + RECORD_SIZE])
+                for i in range(0, len(buf), RECORD_SIZE)]
+
+    recs = numpy.frombuffer(buf.tobytes(), dtype=numpy.uint8).reshape(-1, RECORD_SIZE)
+    table = numpy.array(CRC_TABLE, dtype=numpy.uint32)
+    crc = numpy.full(len(recs), CRC_INIT, dtype=numpy.uint32)
+    columns = list(range(CRC_OFFSET)) + list(range(CRC_OFFSET + 2, RECORD_SIZE))
+    for col in columns:
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ recs[:, col]]
+    for _ in range(2):
+        crc = ((crc << 8) & 0xffff) ^ table[crc >> 8]
+    return crc.tolist()
+
 
 class CRC(object):
 
     def __init__(self):
-        pass
+        self.crc_poly = CRC_POLY
+        self.crc_sum = CRC_INIT
+
+    def reset(self):
+        self.crc_sum = CRC_INIT
+
+    def update(self, data):
+        """
+        Feeds a chunk of bytes into the running CRC and returns the CRC so far.
+        """
+        self.crc_sum = crc_ccitt(data, self.crc_sum)
+        return self.crc_sum
 
     def calculate(self, s):
-        self.crc_poly = 0x1021
-        self.crc_sum = 0xffff
-        for c in s:
-            self.update_crc(c)
-        r = '%02X' % self.crc_sum
+        self.crc_sum = crc_ccitt(s)
+        r = '%04X' % self.crc_sum
         return [r[i:i+2] for i in range(0, len(r), 2)]
 
     def update_crc(self, c):
-        c <<= 8
-        for i in range(0, 8):
-            xor_flag = ((self.crc_sum ^ c) & 0x8000) != 0
-            self.crc_sum = self.crc_sum << 1
-            if xor_flag:
-                self.crc_sum = self.crc_sum ^ self.crc_poly
-            c = c << 1
-        self.crc_sum &= 0xffff
+        self.crc_sum = ((self.crc_sum << 8) & 0xffff) ^ CRC_TABLE[(self.crc_sum >> 8) ^ c]
 
 if __name__ == '__main__':
     # Test that should return 1AEE
@@ -0,0 +1,164 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Codec for the 32-byte Danish data model records.
+#
+#   Byte  0      version (high nibble), usage type (low nibble)
+#   Byte  1      number of parts in the item
+#   Byte  2      part number
+#   Bytes 3-18   primary item identifier, zero padded
+#   Bytes 19-20  CRC, least significant byte first (see crc.py)
+#   Bytes 21-22  country of the owner library
+#   Bytes 23-31  ISIL of the owner library, zero padded
+#
+# References:
+# RFID Data model for libraries : Doc 067 (July 2005), p. 30
+# <http://www.biblev.no/RFID/dansk_rfid_datamodel.pdf>
+# RFID Data model for libraries (February 2009), p. 30
+# <http://biblstandard.dk/rfid/dk/RFID_Data_Model_for_Libraries_February_2009.pdf>
+
+import struct
+from collections import namedtuple
+
+from .crc import danish_model_crc, danish_model_crcs, RECORD_SIZE, CRC_OFFSET
+
+RECORD = struct.Struct('<BBB16sH2s9s')
+CRC = struct.Struct('<H')
+
+USAGE_TYPES = {
+    0: 'acquisition',
+    1: 'for-circulation',
+    2: 'not-for-circulation',
+    7: 'discarded',
+    8: 'patron-card',
+}
+USAGE_TYPE_CODES = dict((v, k) for k, v in USAGE_TYPES.items())
+
+
+class DanishRecord(namedtuple('DanishRecord', ['id', 'country', 'library', 'partno', 'nparts',
+                                               'usage_type', 'version', 'crc', 'crc_ok'])):
+    """
+    An immutable Danish data model record. `crc` (the stored CRC, as an
+    int) and `crc_ok` are only set for decoded records.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, id='', country='', library='', partno=1, nparts=1,
+                usage_type='for-circulation', version=1, crc=None, crc_ok=None):
+        return super(DanishRecord, cls).__new__(cls, id, country, library, partno, nparts,
+                                                usage_type, version, crc, crc_ok)
+
+    @property
+    def is_blank(self):
+        return self.version == 0 and self.usage_type == 'acquisition'
+
+    def as_dict(self, uid):
+        """
+        Returns the record as a dict, in the form returned by
+        PyRFIDGeek.read_danish_model_tag().
+        """
+        return {
+            'error': '',
+            'is_blank': self.is_blank,
+            'usage_type': self.usage_type,
+            'uid': uid,
+            'id': self.id,
+            'partno': self.partno,
+            'nparts': self.nparts,
+            'country': self.country,
+            'library': self.library,
+            'crc': '%02X%02X' % (self.crc & 0xff, self.crc >> 8) if self.crc is not None else '',
+            'crc_ok': self.crc_ok,
+        }
+
+
+def _decode(fields, calc_crc):
+    header, nparts, partno, itemid, crc, country, library = fields
+    version = header >> 4
+    if version != 0 and version != 1:
+        raise ValueError('unknown-version: %X' % version)
+    usage_type = USAGE_TYPES.get(header & 0x0f)
+    if usage_type is None:
+        raise ValueError('unknown-usage-type: %X' % (header & 0x0f))
+    return DanishRecord(itemid.decode('latin-1').strip('\0'),
+                        country.decode('latin-1'),
+                        library.decode('latin-1').strip('\0'),
+                        partno, nparts, usage_type, version, crc, calc_crc == crc)
+
+
+def decode(data):
+    """
+    Decodes a 32-byte record (bytes, bytearray or memoryview; anything after
+    the first 32 bytes is ignored) into a DanishRecord. Raises ValueError if
+    the data model version or usage type is unknown.
+    """
+    if len(data) < RECORD_SIZE:
+        raise ValueError('Record too short: %d bytes' % len(data))
+    return _decode(RECORD.unpack_from(data), danish_model_crc(data))
+
+
+def decode_many(data):
+    """
+    Decodes records stored back to back in `data`, returning a list of
+    DanishRecords (or the ValueError for records that can't be decoded).
+    The CRCs are calculated in one go, see crc.danish_model_crcs().
+    """
+    data = memoryview(data)
+    crcs = danish_model_crcs(data)
+    records = []
+    for i, calc_crc in enumerate(crcs):
+        try:
+            records.append(_decode(RECORD.unpack_from(data, i * RECORD_SIZE), calc_crc))
+        except ValueError as e:
+            records.append(e)
+    return records
+
+
+def _pack_into(buf, offset, record):
+    # Packs the record with a zero CRC
+    usage_type = record.usage_type
+    if not isinstance(usage_type, int):
+        usage_type = USAGE_TYPE_CODES.get(usage_type)
+        if usage_type is None:
+            raise ValueError('Unknown usage type: %r' % record.usage_type)
+    itemid = record.id.encode('latin-1')
+    country = record.country.encode('latin-1')
+    library = record.library.encode('latin-1')
+    if len(itemid) > 16:
+        raise ValueError('Item id longer than 16 characters: %r' % record.id)
+    if len(country) != 2:
+        raise ValueError('Country must be a two-letter code: %r' % record.country)
+    if len(library) > 9:
+        raise ValueError('Library ISIL longer than 9 characters: %r' % record.library)
+    if not 0 <= record.nparts <= 255 or not 0 <= record.partno <= 255:
+        raise ValueError('Part number and number of parts must be 0-255')
+    if not 0 <= record.version <= 15 or not 0 <= usage_type <= 15:
+        raise ValueError('Version and usage type must be 0-15')
+    RECORD.pack_into(buf, offset, record.version << 4 | usage_type, record.nparts, record.partno,
+                     itemid, 0, country, library)
+
+
+def encode(record):
+    """
+    Encodes a DanishRecord into 32 bytes, with the CRC calculated. Raises
+    ValueError if the record doesn't fit the data model.
+    """
+    buf = bytearray(RECORD_SIZE)
+    _pack_into(buf, 0, record)
+    CRC.pack_into(buf, CRC_OFFSET, danish_model_crc(buf))
+    return bytes(buf)
+
+
+def encode_many(records):
+    """
+    Encodes an iterable of DanishRecords into a single bytes object holding
+    the records back to back, calculating the CRCs in one go.
+    """
+    records = list(records)
+    buf = bytearray(RECORD_SIZE * len(records))
+    for i, record in enumerate(records):
+        _pack_into(buf, i * RECORD_SIZE, record)
+    for i, crc in enumerate(danish_model_crcs(buf)):
+        CRC.pack_into(buf, i * RECORD_SIZE + CRC_OFFSET, crc)
+    return bytes(buf)
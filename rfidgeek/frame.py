@@ -0,0 +1,177 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Binary EVM frame layer.
+#
+# The EVM protocol has a general form as shown below:
+#  1. SOF (Start of File): 0x01
+#  2. LENGTH : Two bytes define the number of bytes in the frame including SOF. Least Significant Byte first!
+#  3. READER_TYPE : 0x03
+#  4. ENTITY : 0x04
+#  5. CMD : The command
+#  6. PRMS : Parameters
+#  7. EOF : 0x0000
+#
+# Frames are sent to the board as ASCII hex. Replies are ASCII text with the
+# results in bracketed records, one per line:
+#   [E00401003C4D2A1B,5A]
+#
+# Reference: TI TRF7970A Evaluation Module (EVM) User's Guide
+#            <http://www.ti.com/litv/pdf/slou321a>
+
+import binascii
+import itertools
+import struct
+
+SOF = 0x01
+READER_TYPE = 0x03
+ENTITY = 0x04
+EOF = b'\x00\x00'
+
+HEADER = struct.Struct('<BHBBB')    # SOF, LENGTH, READER_TYPE, ENTITY, CMD
+FRAME_OVERHEAD = HEADER.size + len(EOF)
+
+# EVM commands
+CMD_REGISTER_WRITE = 0x10
+CMD_ISO15693_INVENTORY = 0x14
+CMD_ISO15693_REQUEST = 0x18
+CMD_ISO14443A_ANTICOLLISION = 0xA0
+CMD_ISO14443B_REQUEST = 0xB0
+CMD_AGC = 0xF0
+CMD_INPUT_SELECTION = 0xF1
+CMD_INITIALIZE = 0xFF
+
+# ISO 15693 request header: flags, command code
+ISO15693_HEADER = struct.Struct('BB')
+
+# ISO 15693 inventory mask: mask length in bits, mask (LSB first)
+INVENTORY_MASK = struct.Struct('<BQ')
+
+# Two-digit hex strings for all byte values
+HEX_BYTES = tuple('%02X' % i for i in range(256))
+
+
+def _flags_value(double_sub_carrier, high_data_rate, inventory, protocol_extension,
+                 afi, single_slot, option, select, address):
+    # Reference: TI TRF9770A Evaluation Module (EVM) User's Guide, p. 8
+    value = 0                                       # bit 8 (RFU) is always zero
+    value |= 0x40 if option else 0                  # bit 7
+    if inventory:
+        value |= 0x20 if single_slot else 0         # bit 6
+        value |= 0x10 if afi else 0                 # bit 5
+    else:
+        value |= 0x20 if address else 0             # bit 6
+        value |= 0x10 if select else 0              # bit 5
+    value |= 0x08 if protocol_extension else 0      # bit 4
+    value |= 0x04 if inventory else 0               # bit 3
+    value |= 0x02 if high_data_rate else 0          # bit 2
+    value |= 0x01 if double_sub_carrier else 0      # bit 1
+    return value
+
+
+# All flag combinations, keyed by the flags() arguments in order
+FLAGS_TABLE = {args: _flags_value(*args)
+               for args in itertools.product((False, True), repeat=9)}
+
+
+def flags(double_sub_carrier=False, high_data_rate=False, inventory=False,
+          protocol_extension=False, afi=False, single_slot=False,
+          option=False, select=False, address=False):
+    """
+    Returns the ISO 15693 request flags byte as an int.
+    """
+    return FLAGS_TABLE[(bool(double_sub_carrier), bool(high_data_rate), bool(inventory),
+                        bool(protocol_extension), bool(afi), bool(single_slot),
+                        bool(option), bool(select), bool(address))]
+
+
+# Frequently used flags
+FLAGS_INVENTORY = flags(inventory=True)
+FLAGS_INVENTORY_SINGLE_SLOT = flags(inventory=True, single_slot=True)
+FLAGS_ADDRESSED = flags(address=True)   # 32 (dec) <-> 20 (hex)
+
+
+def build_frame(cmd, prms=b''):
+    """
+    Returns the binary frame for EVM command `cmd` (int) with parameters
+    `prms` (bytes).
+    """
+    return HEADER.pack(SOF, FRAME_OVERHEAD + len(prms), READER_TYPE, ENTITY, cmd) + prms + EOF
+
+
+def build_iso15693_frame(cmd, flags_value, command_code, data=b''):
+    """
+    Returns the binary frame for an ISO 15693 request sent through EVM
+    command `cmd` (0x14 for inventory, 0x18 for other requests).
+    """
+    return build_frame(cmd, ISO15693_HEADER.pack(flags_value, command_code) + data)
+
+
+def inventory_data(mask_length=0, mask=0):
+    """
+    Returns the data of an ISO 15693 inventory request: the mask length in
+    bits, followed by the mask itself, least significant byte first, padded
+    to whole bytes.
+    """
+    return INVENTORY_MASK.pack(mask_length, mask)[:1 + (mask_length + 7) // 8]
+
+
+def parse_frame(frame):
+    """
+    Splits a binary frame into (cmd, prms). Raises ValueError if the frame
+    is malformed.
+    """
+    if len(frame) < FRAME_OVERHEAD:
+        raise ValueError('Frame too short')
+    sof, length, reader_type, entity, cmd = HEADER.unpack_from(frame)
+    if sof != SOF or length != len(frame) or frame[-2:] != EOF:
+        raise ValueError('Malformed frame')
+    return cmd, bytes(frame[HEADER.size:-2])
+
+
+def encode_frame(frame):
+    """
+    Returns the ASCII hex form of a binary frame, as sent to the board.
+    """
+    return binascii.hexlify(frame).upper()
+
+
+def decode_frame(msg):
+    """
+    Inverse of encode_frame().
+    """
+    return binascii.unhexlify(msg)
+
+
+def reply_complete(msg, expected_records):
+    # For commands where we know how many records to expect (one per
+    # inventory slot, one for addressed commands), the reply is complete as
+    # soon as the last record has been terminated by a line break.
+    if msg.count(b']') < expected_records:
+        return False
+    return msg.rstrip(b'\r\n').endswith(b']') and msg.endswith(b'\n')
+
+
+def parse_records(reply):
+    """
+    Returns the contents of the bracketed records in a reply, as a list of
+    bytes (still in ASCII hex).
+    """
+    view = memoryview(reply)
+    records = []
+    start = reply.find(b'[')
+    while start != -1:
+        end = reply.find(b']', start + 1)
+        if end == -1:
+            break
+        records.append(view[start + 1:end].tobytes())
+        start = reply.find(b'[', end + 1)
+    return records
+
+
+def record_payload(record):
+    """
+    Returns the binary payload of a record with an ISO 15693 response, the
+    first byte being the response flags.
+    """
+    return bytearray(binascii.unhexlify(record))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Counters and histograms for PyRFIDGeek:
+#
+#   metrics = Metrics()
+#   rfid = PyRFIDGeek(port, metrics=metrics)
+#   ...
+#   metrics.snapshot()      # dict
+#   metrics.prometheus()    # Prometheus text exposition format
+#
+# Any object with the same inc() and observe() methods can be passed instead,
+# e.g. to forward the measurements to another metrics library. Without one,
+# PyRFIDGeek skips all measurements.
+#
+# Metrics recorded by PyRFIDGeek:
+#   frames_sent_total{cmd}          frames sent, per EVM command code
+#   bytes_sent_total                bytes written to the serial port
+#   bytes_received_total            bytes read from the serial port
+#   round_trip_seconds{cmd}         frame round-trip time, per EVM command code
+#   timeouts_total                  replies that timed out before completing
+#   inventory_collisions_total      collision records seen by ISO 15693 inventories
+#   write_retries_total             block write attempts that had to be retried
+#   write_failures_total            block writes given up on
+#   crc_failures_total              Danish data model reads with a bad CRC
+
+import bisect
+import threading
+
+# Histogram buckets for latencies, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(labels):
+    return ','.join('%s="%s"' % (k, v) for k, v in labels)
+
+
+class Histogram(object):
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        # (upper bound, cumulative count) pairs, as in Prometheus
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """
+    Thread-safe in-memory counters and histograms. `labels` are given as a
+    tuple of (name, value) pairs.
+    """
+
+    def __init__(self, prefix='rfidgeek_', buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}      # name: {labels: value}
+        self.histograms = {}    # name: {labels: Histogram}
+
+    def inc(self, name, value=1, labels=()):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        Returns the current values as a dict:
+
+            {'counters': {name: {labels: value}},
+             'histograms': {name: {labels: {'count': .., 'sum': ..,
+                                            'buckets': [(upper bound, cumulative count), ..]}}}}
+
+        where `labels` is formatted as in Prometheus (e.g. 'cmd="14"'), and
+        is empty for metrics without labels.
+        """
+        with self.lock:
+            counters = {name: {_format_labels(labels): value for labels, value in series.items()}
+                        for name, series in self.counters.items()}
+            histograms = {name: {_format_labels(labels): {'count': h.count,
+                                                          'sum': h.sum,
+                                                          'buckets': h.cumulative()}
+                                 for labels, h in series.items()}
+                          for name, series in self.histograms.items()}
+        return {'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        """
+        Returns the current values in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in sorted(snapshot['counters'].items()):
+            name = self.prefix + name
+            lines.append('# TYPE %s counter' % name)
+            for labels, value in sorted(series.items()):
+                lines.append('%s%s %s' % (name, '{%s}' % labels if labels else '', value))
+        for name, series in sorted(snapshot['histograms'].items()):
+            name = self.prefix + name
+            lines.append('# TYPE %s histogram' % name)
+            for labels, h in sorted(series.items()):
+                sep = ',' if labels else ''
+                for bound, count in h['buckets']:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s%sle="%s"} %d' % (name, labels, sep, le, count))
+                labels = '{%s}' % labels if labels else ''
+                lines.append('%s_sum%s %r' % (name, labels, h['sum']))
+                lines.append('%s_count%s %d' % (name, labels, h['count']))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,219 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import logging
+from collections import namedtuple
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from .presence import ARRIVED, DEPARTED
+
+logger = logging.getLogger(__name__)
+
+COMPLETE = 'complete'
+INCOMPLETE = 'incomplete'
+
+# `parts` maps part numbers to UIDs
+ItemEvent = namedtuple('ItemEvent', ['event', 'item_id', 'nparts', 'parts'])
+
+
+class ItemParts(object):
+    """
+    The parts of a multi-part item seen so far.
+    """
+
+    __slots__ = ('item_id', 'nparts', 'parts', 'complete', 'deadline', 'reported', 'retries')
+
+    def __init__(self, item_id, nparts, deadline):
+        self.item_id = item_id
+        self.nparts = nparts
+        self.parts = {}
+        self.complete = False
+        self.deadline = deadline
+        self.reported = False
+        self.retries = 0
+
+    @property
+    def missing(self):
+        return [p for p in range(1, self.nparts + 1) if p not in self.parts]
+
+
+class PartAggregator(object):
+    """
+    Groups the tags of multi-part items (e.g. a box with three CDs, each
+    tagged with the same item id, part number 1-3 and 3 parts) and tells
+    when all parts of an item are present:
+
+        aggregator = PartAggregator(rfid)
+        for event in presence.events():
+            for item_event in aggregator.update([event]):
+                if item_event.event == COMPLETE:
+                    ...     # all parts present
+                else:
+                    ...     # some parts are missing
+
+    A COMPLETE event is emitted as soon as the last part has been read.
+    Items still missing parts `max_wait` seconds after the first part was
+    seen get an INCOMPLETE event, as do complete items losing a part.
+    Meanwhile, poll() retries incomplete items with a targeted inventory in
+    which all tags already known are kept quiet, so only new tags answer.
+    The tags stay quiet until no item is waiting for parts any more, and are
+    then reset to ready.
+
+    Single-part items get a COMPLETE event right away.
+    """
+
+    def __init__(self, reader=None, max_wait=2.0, retries=3, callback=None):
+        self.reader = reader
+        self.max_wait = max_wait
+        self.retries = retries
+        self.callback = callback
+        self.items = {}     # item id: ItemParts
+        self.uids = {}      # uid: item id
+        self.quieted = set()    # UIDs put to quiet state by retry()
+
+    def _emit(self, events):
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def add(self, uid, item, now=None):
+        """
+        Adds a tag read by read_danish_model_tag(), returning the resulting
+        events. Tags that couldn't be read, or are blank, are ignored.
+        """
+        if item.get('error') or item.get('is_blank') or 'id' not in item:
+            return []
+        if now is None:
+            now = monotonic()
+        item_id = item['id']
+        if self.uids.get(uid) == item_id:
+            return []   # already known, e.g. found by retry()
+        nparts = item.get('nparts') or 1
+        self.uids[uid] = item_id
+        if nparts <= 1:
+            return self._emit([ItemEvent(COMPLETE, item_id, 1, {1: uid})])
+
+        state = self.items.get(item_id)
+        if state is None or state.nparts != nparts:
+            state = self.items[item_id] = ItemParts(item_id, nparts, now + self.max_wait)
+        state.parts[item.get('partno')] = uid
+        if state.complete or state.missing:
+            return []
+        state.complete = True
+        return self._emit([ItemEvent(COMPLETE, item_id, nparts, dict(state.parts))])
+
+    def remove(self, uid, now=None):
+        """
+        Removes a tag that has left the field, returning the resulting
+        events.
+        """
+        item_id = self.uids.pop(uid, None)
+        self.quieted.discard(uid)
+        state = self.items.get(item_id)
+        if state is None:
+            return []
+        for partno, part_uid in list(state.parts.items()):
+            if part_uid == uid:
+                del state.parts[partno]
+        if not state.parts:
+            del self.items[item_id]
+            if not state.complete:
+                return []
+        if state.complete:
+            # Start waiting for the part to come back
+            if now is None:
+                now = monotonic()
+            state.complete = False
+            state.deadline = now + self.max_wait
+            state.reported = True
+            state.retries = 0
+            return self._emit([ItemEvent(INCOMPLETE, item_id, state.nparts, dict(state.parts))])
+        return []
+
+    def expire(self, now=None):
+        """
+        Returns INCOMPLETE events for the items that have waited too long.
+        """
+        if now is None:
+            now = monotonic()
+        events = []
+        for state in self.items.values():
+            if not state.complete and not state.reported and now >= state.deadline:
+                state.reported = True
+                events.append(ItemEvent(INCOMPLETE, state.item_id, state.nparts, dict(state.parts)))
+        return self._emit(events)
+
+    def pending(self):
+        """
+        Returns the incomplete items still waiting for parts.
+        """
+        return [state for state in self.items.values() if not state.complete and not state.reported]
+
+    def update(self, presence_events, now=None):
+        """
+        Handles events from a PresenceTracker: arrived tags are read (using
+        the reader's tag cache) and added, departed tags removed. Then runs
+        poll(). Returns the resulting events.
+        """
+        events = []
+        for event in presence_events:
+            if event.event == ARRIVED:
+                events.extend(self.add(event.uid, self.reader.read_danish_model_tag(event.uid, cached=True), now))
+            elif event.event == DEPARTED:
+                events.extend(self.remove(event.uid, now))
+        events.extend(self.poll(now))
+        return events
+
+    def poll(self, now=None):
+        """
+        Retries the pending items with a targeted inventory (see retry()),
+        then returns the events from that and from expire().
+        """
+        events = []
+        if self.reader is not None and any(s.retries < self.retries for s in self.pending()):
+            events.extend(self.retry(now))
+        events.extend(self.expire(now))
+        if self.quieted and not any(s.retries < self.retries for s in self.pending()):
+            self.release()
+        return events
+
+    def retry(self, now=None):
+        """
+        Runs an inventory in which the tags already known are kept quiet, so
+        that tags hidden by collisions or missed reads answer, and reads the
+        new tags found. Known tags are only put to quiet state once, and stay
+        quiet until release(). Returns the resulting events.
+        """
+        reader = self.reader
+        for state in self.pending():
+            state.retries += 1
+        for uid in self.uids:
+            if uid not in reader.quieted_uids:
+                reader.stay_quiet(uid)
+                self.quieted.add(uid)
+        events = []
+        for uid in list(reader.inventory(anticollision=True) or ()):
+            if uid not in self.uids:
+                events.extend(self.add(uid, reader.read_danish_model_tag(uid), now))
+        logger.debug('Targeted inventory for %d incomplete item(s): %d event(s)',
+                     len(self.pending()), len(events))
+        return events
+
+    def release(self):
+        """
+        Resets the tags put to quiet state by retry() to ready. Called by
+        poll() once no item is waiting for parts.
+        """
+        reader = self.reader
+        for uid in self.quieted:
+            if uid in reader.quieted_uids and not reader.reset_to_ready(uid):
+                # Most likely the tag has left the field, and it powers up
+                # in ready state when it comes back
+                reader.quieted_uids.discard(uid)
+        self.quieted.clear()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import threading
+
+
+class AdaptivePoller(object):
+    """
+    Decides how long to wait between inventories: polls every
+    `min_interval` seconds right after something happened (a tag arrived or
+    departed), and backs off exponentially by `backoff` after every quiet
+    poll, up to `present_interval` while there are tags in the field and up
+    to `max_interval` while the field is empty.
+
+        poller = AdaptivePoller()
+        while True:
+            events = presence.poll()
+            poller.update(bool(events), present=len(presence) > 0)
+            ...
+            poller.wait()
+
+    Call wake() from any thread (e.g. when the user presses a button or a
+    write is requested) to end the current wait immediately and go back to
+    polling fast.
+    """
+
+    def __init__(self, min_interval=0.1, max_interval=2.0, present_interval=0.5, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.present_interval = max(min_interval, min(present_interval, max_interval))
+        self.backoff = backoff
+        self.interval = min_interval
+        self._wakeup = threading.Event()
+
+    def update(self, activity, present=False):
+        """
+        Adjusts the interval after a poll. `activity` tells whether anything
+        changed, `present` whether there are tags in the field.
+        """
+        if activity:
+            self.interval = self.min_interval
+        else:
+            limit = self.present_interval if present else self.max_interval
+            self.interval = min(self.interval * self.backoff, limit)
+            if self.interval < self.min_interval:
+                self.interval = self.min_interval
+        return self.interval
+
+    def wake(self):
+        """
+        Ends the current (or next) wait and resets the interval.
+        """
+        self.interval = self.min_interval
+        self._wakeup.set()
+
+    def wait(self):
+        """
+        Waits for the current interval, or until wake() is called. Returns
+        True if woken.
+        """
+        woken = self._wakeup.wait(self.interval)
+        self._wakeup.clear()
+        return bool(woken)
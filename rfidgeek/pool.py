@@ -0,0 +1,235 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from queue import Queue
+except ImportError:
+    # Python 2
+    from Queue import Queue
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from .rfidgeek import PyRFIDGeek, ISO15693
+
+logger = logging.getLogger(__name__)
+
+
+class _Job(object):
+
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Worker(threading.Thread):
+    # Owns a single reader and runs jobs on it, one at a time. The reader is
+    # (re)opened on demand, at most once every `retry_interval` seconds.
+
+    def __init__(self, reader_id, opener, retry_interval):
+        super(_Worker, self).__init__(name='ReaderPool-%s' % reader_id)
+        self.daemon = True
+        self.reader_id = reader_id
+        self.opener = opener
+        self.retry_interval = retry_interval
+        self.reader = None
+        self.error = None
+        self.last_attempt = None
+        self.current = None
+        self.jobs = Queue()
+
+    @property
+    def busy(self):
+        return self.current is not None and not self.current.done.is_set()
+
+    @property
+    def available(self):
+        if self.busy:
+            return False
+        if self.reader is not None:
+            return True
+        return self.last_attempt is None or monotonic() - self.last_attempt >= self.retry_interval
+
+    def submit(self, func):
+        job = _Job(func)
+        self.current = job
+        self.jobs.put(job)
+        return job
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                if self.reader is None:
+                    self.last_attempt = monotonic()
+                    self.reader = self.opener()
+                    self.error = None
+                job.result = job.func(self.reader)
+            except Exception as e:
+                logger.warn('Reader %s failed: %s', self.reader_id, e)
+                job.error = e
+                self.error = e
+                self._close()
+            finally:
+                job.done.set()
+        self._close()
+
+    def _close(self):
+        if self.reader is not None:
+            try:
+                self.reader.close()
+            except Exception:
+                pass
+            self.reader = None
+
+
+class ReaderPool(object):
+    """
+    Runs inventories and reads on several readers in parallel, one thread
+    per reader, and merges the results:
+
+        pool = ReaderPool(['/dev/ttyUSB0', '/dev/ttyUSB1'])
+        pool.set_protocol(ISO15693)
+        seen = pool.inventory()                 # {uid: set of reader ids}
+        items = pool.read_danish_model_tags(seen)
+
+    The reader id is the serial port name. A reader that fails (e.g. because
+    it was unplugged) or doesn't answer within `timeout` seconds is left out
+    of the results, without holding up the others, and is reopened after
+    `retry_interval` seconds. See status().
+
+    Further keyword arguments are passed on to PyRFIDGeek.
+    """
+
+    def __init__(self, ports, timeout=2.0, retry_interval=5.0, reader_class=PyRFIDGeek, **reader_kwargs):
+        self.timeout = timeout
+        self.protocol = None
+        self.workers = OrderedDict()
+        for port in ports:
+            opener = self._opener(reader_class, port, reader_kwargs)
+            worker = _Worker(port, opener, retry_interval)
+            worker.start()
+            self.workers[port] = worker
+
+    def _opener(self, reader_class, port, reader_kwargs):
+        def opener():
+            reader = reader_class(port, **reader_kwargs)
+            if self.protocol is not None:
+                reader.set_protocol(self.protocol)
+            return reader
+        return opener
+
+    def run(self, func, reader_ids=None):
+        """
+        Calls `func(reader)` on all available readers (or the given ones) in
+        parallel, and returns a dict of the results by reader id. Readers
+        that fail or time out are left out.
+        """
+        if reader_ids is None:
+            reader_ids = self.workers.keys()
+        return self._run(dict((reader_id, func) for reader_id in reader_ids))
+
+    def _run(self, funcs):
+        # Runs funcs[reader_id](reader) on the available readers in parallel
+        jobs = {}
+        for reader_id, func in funcs.items():
+            worker = self.workers[reader_id]
+            if worker.available:
+                jobs[reader_id] = worker.submit(func)
+
+        deadline = monotonic() + self.timeout
+        results = {}
+        for reader_id, job in jobs.items():
+            if not job.done.wait(max(0, deadline - monotonic())):
+                logger.warn('Reader %s timed out', reader_id)
+                continue
+            if job.error is None:
+                results[reader_id] = job.result
+        return results
+
+    def set_protocol(self, protocol=ISO15693):
+        self.protocol = protocol
+        self.run(lambda reader: reader.set_protocol(protocol))
+
+    def inventory(self, **kwargs):
+        """
+        Runs an inventory on all readers and returns a dict mapping each UID
+        found to the set of readers that saw it.
+        """
+        seen = {}
+        results = self.run(lambda reader: list(reader.inventory(**kwargs) or ()))
+        for reader_id, uids in results.items():
+            for uid in uids:
+                seen.setdefault(uid, set()).add(reader_id)
+        return seen
+
+    def read_danish_model_tags(self, seen, cached=True):
+        """
+        Reads the tags in `seen` (as returned by inventory()), spreading the
+        reads over the readers that saw them. Returns a dict mapping UIDs to
+        the decoded items, each with the 'reader' that read it and the set of
+        readers it was 'seen_by' added.
+        """
+        assigned = dict((reader_id, []) for reader_id in self.workers)
+        for uid, reader_ids in sorted(seen.items()):
+            reader_id = min(reader_ids, key=lambda r: len(assigned[r]))
+            assigned[reader_id].append(uid)
+
+        def read(uids):
+            return lambda reader: [(uid, reader.read_danish_model_tag(uid, cached=cached)) for uid in uids]
+
+        results = self._run(dict((reader_id, read(uids))
+                                 for reader_id, uids in assigned.items() if uids))
+        items = {}
+        for reader_id, result in results.items():
+            for uid, item in result:
+                items[uid] = dict(item, reader=reader_id, seen_by=seen[uid])
+        return items
+
+    def scan(self, interval=0.5, **kwargs):
+        """
+        Generator running an inventory on all readers every `interval`
+        seconds, yielding the merged result (see inventory()) each time.
+        """
+        while True:
+            started = monotonic()
+            yield self.inventory(**kwargs)
+            time.sleep(max(0, interval - (monotonic() - started)))
+
+    def status(self):
+        """
+        Returns a dict with the state of each reader: 'ok', 'busy',
+        'not-connected', or the last error.
+        """
+        status = {}
+        for reader_id, worker in self.workers.items():
+            if worker.busy:
+                status[reader_id] = 'busy'
+            elif worker.reader is not None:
+                status[reader_id] = 'ok'
+            elif worker.error is not None:
+                status[reader_id] = str(worker.error)
+            else:
+                status[reader_id] = 'not-connected'
+        return status
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.stop()
+        for worker in self.workers.values():
+            worker.join(self.timeout)
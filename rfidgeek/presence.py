@@ -0,0 +1,157 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import logging
+import time
+from collections import namedtuple
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+logger = logging.getLogger(__name__)
+
+ARRIVED = 'arrived'
+DEPARTED = 'departed'
+STILL_PRESENT = 'still-present'
+
+PresenceEvent = namedtuple('PresenceEvent', ['event', 'uid', 'tag'])
+
+
+class TagPresence(object):
+    """
+    Presence state of a single tag. Timestamps are from time.time().
+    """
+    __slots__ = ('uid', 'first_seen', 'last_seen', 'polls_seen', 'misses')
+
+    def __init__(self, uid, now):
+        self.uid = uid
+        self.first_seen = now
+        self.last_seen = now
+        self.polls_seen = 1
+        self.misses = 0
+
+    def __repr__(self):
+        return '<TagPresence %s: seen in %d polls, %d misses>' % (self.uid, self.polls_seen, self.misses)
+
+
+class PresenceTracker(object):
+    """
+    Turns successive inventories into arrive/depart events per tag.
+
+    A tag has departed once it has been missing from `max_misses`
+    consecutive inventories, so tags missing a single poll because of RF
+    noise don't come back as new. Events are passed to `callback` (if given)
+    and returned from update() and poll():
+
+        tracker = PresenceTracker(rfid, max_misses=2)
+        for event in tracker.events(interval=0.5):
+            if event.event == ARRIVED:
+                item = rfid.read_danish_model_tag(event.uid)
+
+    With report_present=True, a STILL_PRESENT event is emitted for each tag
+    seen again.
+
+    Tags the reader has put to quiet state (see PyRFIDGeek.stay_quiet())
+    don't answer inventories. After `max_quiet_misses` inventories without
+    them, they are checked with an addressed request (is_present()), and
+    have departed if they don't answer.
+    """
+
+    def __init__(self, reader=None, max_misses=2, callback=None, report_present=False,
+                 max_quiet_misses=5):
+        self.reader = reader
+        self.max_misses = max_misses
+        self.max_quiet_misses = max_quiet_misses
+        self.callback = callback
+        self.report_present = report_present
+        self.present = {}
+
+    def update(self, uids, now=None):
+        """
+        Updates the state with the UIDs from one inventory and returns the
+        resulting events.
+        """
+        if now is None:
+            now = time.time()
+        events = []
+        seen = set()
+        quiet = getattr(self.reader, 'quieted_uids', ())
+        for uid in uids:
+            # Events follow the inventory order
+            if uid in seen:
+                continue
+            seen.add(uid)
+            tag = self.present.get(uid)
+            if tag is None:
+                tag = TagPresence(uid, now)
+                self.present[uid] = tag
+                events.append(PresenceEvent(ARRIVED, uid, tag))
+            else:
+                tag.last_seen = now
+                tag.polls_seen += 1
+                tag.misses = 0
+                if self.report_present:
+                    events.append(PresenceEvent(STILL_PRESENT, uid, tag))
+        for uid, tag in list(self.present.items()):
+            if uid in seen:
+                continue
+            tag.misses += 1
+            if uid in quiet:
+                if tag.misses < self.max_quiet_misses:
+                    continue
+                if self.reader.is_present(uid):
+                    tag.misses = 0
+                    continue
+                # Gone, so no longer quiet
+                quiet.discard(uid)
+            elif tag.misses < self.max_misses:
+                continue
+            del self.present[uid]
+            events.append(PresenceEvent(DEPARTED, uid, tag))
+
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def poll(self, **kwargs):
+        """
+        Runs an inventory on the reader and returns the resulting events.
+        Keyword arguments are passed on to inventory().
+        """
+        return self.update(self.reader.inventory(**kwargs) or ())
+
+    def events(self, interval=0.5, poller=None, **kwargs):
+        """
+        Generator polling the reader every `interval` seconds and yielding
+        the events. If a polling.AdaptivePoller is given, it decides the
+        interval instead.
+        """
+        while True:
+            started = monotonic()
+            events = self.poll(**kwargs)
+            for event in events:
+                yield event
+            if poller is not None:
+                activity = any(event.event != STILL_PRESENT for event in events)
+                poller.update(activity, present=bool(self.present))
+                poller.wait()
+            else:
+                time.sleep(max(0, interval - (monotonic() - started)))
+
+    def forget(self, uid):
+        """
+        Forgets the tag without emitting a departed event, so that it will
+        arrive again the next time it is seen. Useful if handling the arrival
+        failed, e.g. because the tag couldn't be read.
+        """
+        self.present.pop(uid, None)
+
+    def __contains__(self, uid):
+        return uid in self.present
+
+    def __len__(self):
+        return len(self.present)
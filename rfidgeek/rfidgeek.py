@@ -4,10 +4,17 @@
 from __future__ import print_function
 import serial
 import logging
-import re
-import pprint
+import struct
 import time
 import binascii
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
 
 try:
     # Use colored logging if termcolor is available
@@ -17,7 +24,15 @@ except ImportError:
     def colored(msg, *args, **kwargs):
         return msg
 
-from .crc import CRC
+from .capture import CaptureTransport
+from .cache import LRUCache, TTLCache
+from . import danish
+from .frame import (build_frame, build_iso15693_frame, encode_frame, decode_frame,
+                    flags, parse_records, record_payload, HEX_BYTES,
+                    FLAGS_INVENTORY, FLAGS_INVENTORY_SINGLE_SLOT, FLAGS_ADDRESSED,
+                    CMD_ISO15693_INVENTORY, CMD_ISO15693_REQUEST, CMD_ISO14443A_ANTICOLLISION,
+                    CMD_ISO14443B_REQUEST,
+                    inventory_data, reply_complete)
 
 logger = logging.getLogger(__name__)
 
@@ -25,99 +40,406 @@ ISO15693 = 'ISO15693'
 ISO14443A = 'ISO14443A'
 ISO14443B = 'ISO14443B'
 
+# Reader registers
+CHIP_STATUS_CONTROL = '00'
+ISO_CONTROL = '01'
+
+# EVM commands to switch the LEDs on and off
+LED_ON_COMMANDS = {2: 'FB', 3: 'F9', 4: 'F7', 5: 'F5', 6: 'F3'}
+LED_OFF_COMMANDS = {2: 'FC', 3: 'FA', 4: 'F8', 5: 'F6', 6: 'F4'}
+
+# ISO 15693 error codes: command not supported, command not recognized
+ERROR_NOT_SUPPORTED = (0x01, 0x02)
+
+# AFI values used for security (EAS) by the Danish data model: items that are
+# checked in, and items that are checked out
+AFI_SECURED = 0x07
+AFI_UNSECURED = 0xC2
+
+# Max. number of data bytes to read or write in a single frame
+MAX_FRAME_DATA = 64
+
+# Tag memory layout and identification, from Get System Information
+TagInfo = namedtuple('TagInfo', ['dsfid', 'afi', 'block_size', 'block_count',
+                                 'ic_manufacturer', 'ic_reference'])
+
+# Passed to PyRFIDGeek.trace after each frame: EVM command code (int), the
+# binary frame sent, the raw reply and the round-trip time in seconds
+FrameTrace = namedtuple('FrameTrace', ['cmd', 'frame', 'reply', 'elapsed'])
+
+# Assumed for tags not supporting Get System Information
+DEFAULT_TAG_INFO = TagInfo(None, None, 4, 8, None, None)
+
+# The UID is 64 bits, and the slot number takes 4 bits of the mask
+MAX_MASK_LENGTH = 60
+
+ISO_CONTROL_VALUES = {
+    ISO15693: '00',   # 01 for 1-out-of-256 modulation
+    ISO14443A: '09',
+    ISO14443B: '0C',
+}
+
 
 def flagsbyte(double_sub_carrier=False, high_data_rate=False, inventory=False,
               protocol_extension=False, afi=False, single_slot=False,
               option=False, select=False, address=False):
-    # Method to construct the flags byte
+    # Method to construct the flags byte as a two-digit hex string
     # Reference: TI TRF9770A Evaluation Module (EVM) User's Guide, p. 8
     #            <http://www.ti.com/litv/pdf/slou321a>
-    bits = '0'                                  # bit 8 (RFU) is always zero
-    bits += '1' if option else '0'              # bit 7
-    if inventory:
-        bits += '1' if single_slot else '0'     # bit 6
-        bits += '1' if afi else '0'             # bit 5
-    else:
-        bits += '1' if address else '0'         # bit 6
-        bits += '1' if select else '0'          # bit 5
-    bits += '1' if protocol_extension else '0'  # bit 4
-    bits += '1' if inventory else '0'           # bit 3
-    bits += '1' if high_data_rate else '0'      # bit 2
-    bits += '1' if double_sub_carrier else '0'  # bit 1
-
-    return '%02X' % int(bits, 2)     # return hex byte
+    return HEX_BYTES[flags(double_sub_carrier, high_data_rate, inventory,
+                           protocol_extension, afi, single_slot,
+                           option, select, address)]
+
+
+def iso14443a_uid(record):
+    """
+    Returns the UID (hex string) from a record of the ISO 14443A
+    anticollision command, or None if the record isn't a valid UID.
+    """
+    iba = record_payload(record)
+    # Assume 4-byte UID + 1 byte Block Check Character (BCC)
+    if len(iba) != 5:
+        logger.warn('Encountered tag with UID of unknown length')
+        return None
+    if iba[0] ^ iba[1] ^ iba[2] ^ iba[3] ^ iba[4] != 0:
+        logger.warn('BCC check failed for tag')
+        return None
+    uid = record[:8].decode('ascii')  # hex string, so each byte is two chars
+    logger.debug('Found tag: %s (%s) ', uid, record[8:])
+    return uid
+
+
+def iso14443b_pupi(record):
+    """
+    Returns the PUPI (hex string) from an ATQB record of the ISO 14443B
+    request command, or None if the record isn't a valid ATQB.
+    """
+    # ATQB: 0x50, PUPI (4 bytes), application data (4 bytes), protocol info
+    # (3 or 4 bytes), possibly followed by the CRC
+    try:
+        iba = record_payload(record)
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if len(iba) < 12 or iba[0] != 0x50:
+        return None
+    pupi = record[2:10].decode('ascii')
+    logger.debug('Found tag: %s (%s) ', pupi, record[10:])
+    return pupi
+
+
+def decode_danish_model(uid, response):
+    """
+    Decodes the memory of a tag following the Danish data model into a
+    dict. `response` is the tag memory (bytearray) from block 0 on.
+    """
+    try:
+        record = danish.decode(response)
+    except ValueError as e:
+        logger.warn('Unable to decode %s: %s', binascii.hexlify(response), e)
+        return {'error': str(e)}
+    return record.as_dict(uid)
+
+
+class ISO15693Inventory(object):
+    """
+    The slot and mask handling of an ISO 15693 inventory, independent of
+    how the frames are sent, so that PyRFIDGeek and aio.AsyncPyRFIDGeek
+    share it:
+
+        inventory = ISO15693Inventory(anticollision=True)
+        for data in inventory.requests():
+            records = ...   # send an inventory request (0x01) with
+                            # inventory.flags_value and data, expecting
+                            # inventory.expected_records records
+            for uid in inventory.handle(records):
+                ...
+
+    See PyRFIDGeek.inventory_iso15693() for the arguments. Statistics
+    (rounds, frames, collisions, tags) are kept in `stats`.
+    """
+
+    def __init__(self, single_slot=False, anticollision=False, afi=None, mask=0, mask_length=0,
+                 metrics=None):
+        if not 0 <= mask_length <= 64 or not 0 <= mask < 1 << mask_length:
+            raise ValueError('Invalid mask %X/%d' % (mask, mask_length))
+        if afi is not None and not 0 <= afi <= 0xff:
+            raise ValueError('Invalid AFI: %r' % afi)
+        self.anticollision = anticollision and not single_slot
+        self.expected_records = 1 if single_slot else 16
+        if afi is None:
+            self.flags_value = FLAGS_INVENTORY_SINGLE_SLOT if single_slot else FLAGS_INVENTORY
+            self.prefix = b''
+        else:
+            # The AFI goes before the mask
+            self.flags_value = flags(inventory=True, afi=True, single_slot=single_slot)
+            self.prefix = struct.pack('B', afi)
+        self.metrics = metrics
+        self.stats = {'rounds': 0, 'frames': 0, 'collisions': 0, 'tags': 0}
+        self._pending = [(mask_length, mask)]    # (mask length in bits, mask)
+        self._current = None
+
+    def requests(self):
+        """
+        Generator yielding the data (mask, preceded by the AFI if given) of
+        each inventory request to send. The reply to each request must be
+        passed to handle() before asking for the next one, since colliding
+        slots add requests to the following round.
+        """
+        while self._pending:
+            self.stats['rounds'] += 1
+            pending, self._pending = self._pending, []
+            for mask_length, mask in pending:
+                self.stats['frames'] += 1
+                self._current = (mask_length, mask)
+                yield self.prefix + inventory_data(mask_length, mask)
+        logger.debug('Inventory done: %(tags)d tags, %(collisions)d collisions, '
+                     '%(rounds)d rounds, %(frames)d frames', self.stats)
+
+    def handle(self, records):
+        """
+        Handles the records of the reply to the last request, returning the
+        list of UIDs found.
+        """
+        mask_length, mask = self._current
+        uids = []
+        for slot, itm in enumerate(records):
+            uid, _, rssi = itm.partition(b',')
+            if uid == b'z':
+                self.stats['collisions'] += 1
+                logger.debug('Tag conflict in slot %d!', slot)
+                if self.metrics is not None:
+                    self.metrics.inc('inventory_collisions_total')
+                if not self.anticollision:
+                    continue
+                if mask_length + 4 > MAX_MASK_LENGTH:
+                    logger.warn('Unable to resolve collision at mask %X/%d', mask, mask_length)
+                    continue
+                self._pending.append((mask_length + 4, mask | slot << mask_length))
+            elif len(uid) == 16:
+                uid = uid.decode('ascii')
+                self.stats['tags'] += 1
+                logger.debug('Found tag: %s (%s) ', uid, rssi)
+                uids.append(uid)
+        return uids
+
+
+def _use_color():
+    # Colors only make sense if the log messages end up on a terminal
+    log = logger
+    while log is not None:
+        for handler in log.handlers:
+            stream = getattr(handler, 'stream', None)
+            isatty = getattr(stream, 'isatty', None)
+            if isatty is not None and isatty():
+                return True
+        if not log.propagate:
+            break
+        log = log.parent
+    return False
+
+
+def _format_sent(hex_msg):
+    # Frame header, command code (underlined) and parameters (green)
+    if not _use_color():
+        return hex_msg
+    return (hex_msg[0:10] + colored(hex_msg[10:12], attrs=['underline']) +
+            hex_msg[12:14] + colored(hex_msg[14:], 'green'))
+
+
+def _format_received(msg):
+    text = repr(msg)
+    text = text[text.index("'") + 1:-1]     # strip the b'' of Python 3
+    if not _use_color():
+        return text
+    return colored(text, 'cyan')
+
+
+def _runs(blocks, max_length):
+    # Splits a sorted list of block numbers into runs of at most `max_length`
+    # consecutive blocks, as (first block, number of blocks) tuples.
+    runs = []
+    for x in blocks:
+        if runs and runs[-1][0] + runs[-1][1] == x and runs[-1][1] < max_length:
+            runs[-1][1] += 1
+        else:
+            runs.append([x, 1])
+    return runs
 
 
 class PyRFIDGeek(object):
 
     def __init__(self, serial_port, serial_baud_rate=115200, serial_stop_bits=serial.STOPBITS_ONE,
-                 serial_parity=serial.PARITY_NONE, serial_data_bits=serial.EIGHTBITS, debug=False):
-
-        self.protocol = None
-
-        if debug:
-            logger.setLevel(logging.DEBUG)
+                 serial_parity=serial.PARITY_NONE, serial_data_bits=serial.EIGHTBITS, debug=False,
+                 timeout=0.1, idle_timeout=0.005, poll_interval=0.0005,
+                 query_system_information=True, tag_info_cache_size=1024,
+                 tag_cache_size=1024, tag_cache_ttl=30.0, transport=None, capture=None, metrics=None):
+
+        # Shadow of the reader state, so that set_protocol() only needs to send
+        # the commands that actually change something.
+        self.reset_register_shadow()
+
+        # Reply timing:
+        #   timeout: a reply is considered finished after this many seconds of
+        #            silence. This is only an upper bound, replies are returned
+        #            as soon as they are recognized as complete.
+        #   idle_timeout: for replies without bracketed records, the quiet gap
+        #            after a line break that marks the end of the reply.
+        #   poll_interval: how long to sleep between polls of the input buffer.
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+
+        # Round-trip latency per EVM command code, see round_trip_stats()
+        self.last_round_trip = None
+        self._round_trips = {}
+
+        # Statistics for the last ISO 15693 inventory
+        self.inventory_stats = None
+
+        # Within a quiet session, tags are put to quiet state once read, see
+        # quiet_session()
+        self.quiet_after_read = False
+        self.quieted_uids = set()
+
+        # UIDs (bytes) of tags that don't support Write Multiple Blocks
+        self._write_multiple_unsupported = set()
+
+        # Tag memory layout per UID (bytes), see get_system_information()
+        self.query_system_information = query_system_information
+        self.tag_info_cache = LRUCache(tag_info_cache_size)
+
+        # Decoded Danish data model records per UID (bytes), see
+        # read_danish_model_tag()
+        self.tag_cache = TTLCache(tag_cache_size, tag_cache_ttl)
+
+        # Context manager held around each frame when the reader is shared by
+        # several threads, see scheduler.CommandScheduler
+        self.frame_lock = None
+
+        # Called with a FrameTrace after each frame, if set
+        self.trace = None
+
+        # Counters and histograms, see metrics.Metrics. Nothing is measured
+        # if this is None.
+        self.metrics = metrics
+
+        # `debug` is no longer used: logging levels are left to the
+        # application, see README.
+
+        if transport is not None:
+            # Any object with the serial port methods used here (in_waiting,
+            # read, write, close), e.g. a simulator.SimulatedReader
+            self.sp = transport
         else:
-            logger.setLevel(logging.INFO)
+            self.sp = serial.Serial(port=serial_port,
+                                    baudrate=serial_baud_rate,
+                                    stopbits=serial_stop_bits,
+                                    parity=serial_parity,
+                                    bytesize=serial_data_bits,
+                                    timeout=timeout)
 
-        self.sp = serial.Serial(port=serial_port,
-                                baudrate=serial_baud_rate,
-                                stopbits=serial_stop_bits,
-                                parity=serial_parity,
-                                bytesize=serial_data_bits,
-                                timeout=0.1)
+            if not self.sp:
+                raise StandardError('Could not connect to serial port ' + serial_port)
 
-        if not self.sp:
-            raise StandardError('Could not connect to serial port ' + serial_port)
+        if capture is not None:
+            # Record all traffic to this file, see capture.ReplayTransport
+            self.sp = CaptureTransport(self.sp, capture)
 
-        logger.debug('Connected to ' + self.sp.portstr)
+        logger.debug('Connected to %s', self.sp.portstr)
         self.flush()
 
-    def set_protocol(self, protocol=ISO15693):
-
-        self.protocol = protocol
-
-        # 1. Initialize reader: 0xFF
-        # 0108000304 FF 0000
-        self.issue_evm_command(cmd='FF')  # Should return "TRF7970A EVM"
-
-        # self.issue_evm_command(cmd='10', prms='0121')
-        # self.issue_evm_command(cmd='10', prms='0021')
+    def set_protocol(self, protocol=ISO15693, force=False):
+        """
+        Sets up the reader for the given protocol. Only the commands needed to
+        bring the reader from its current (shadowed) state to the requested
+        one are sent, so calling this repeatedly is cheap. Use force=True to
+        re-initialize the reader from scratch, e.g. after it has been reset.
+        """
+        if force:
+            self.reset_register_shadow()
 
-        # Select protocol: 15693 with full power
-        self.issue_evm_command(cmd='10', prms='00210100')
+        if not self._initialized:
+            # 1. Initialize reader: 0xFF
+            # 0108000304 FF 0000
+            self.issue_evm_command(cmd='FF', expected_records=0)  # Should return "TRF7970A EVM"
+            self._initialized = True
 
-        # Setting up registers:
+        # 2. Setting up registers (single write of the registers that change):
         #   0x00 Chip Status Control: Set to 0x21 for full power, 0x31 for half power
         #   0x01 ISO Control: Set to 0x00 for ISO15693, 0x09 for ISO14443A, 0x0C for ISO14443B
-        protocol_values = {
-            ISO15693: '00',   # 01 for 1-out-of-256 modulation
-            ISO14443A: '09',
-            ISO14443B: '0C',
-        }
-        self.issue_evm_command(cmd='10', prms='0021' + '01' + protocol_values[protocol])
+        self.write_registers([(CHIP_STATUS_CONTROL, '21'),
+                              (ISO_CONTROL, ISO_CONTROL_VALUES[protocol])])
 
         # 3. AGC selection (0xF0) : AGC enable (0x00)
         # 0109000304 F0 00 0000
-        self.issue_evm_command(cmd='F0', prms='00')
+        if self._agc != '00':
+            self.issue_evm_command(cmd='F0', prms='00', expected_records=0)
+            self._agc = '00'
 
         # 4. AM/PM input selection (0xF1) : AM input (0xFF)
         # 0109000304 F1 FF 0000
-        self.issue_evm_command(cmd='F1', prms='FF')
+        if self._input_selection != 'FF':
+            self.issue_evm_command(cmd='F1', prms='FF', expected_records=0)
+            self._input_selection = 'FF'
+
+        self.protocol = protocol
+
+    def switch_protocol(self, protocol):
+        """
+        Switches protocol on an already set up reader by rewriting only the
+        ISO Control register (0x01). Falls back to set_protocol() if the
+        reader hasn't been set up yet.
+        """
+        if not self._initialized or self.registers.get(CHIP_STATUS_CONTROL) is None:
+            return self.set_protocol(protocol)
+        self.write_registers([(ISO_CONTROL, ISO_CONTROL_VALUES[protocol])])
+        self.protocol = protocol
+
+    def write_registers(self, values):
+        """
+        Writes (address, value) pairs of two-digit hex strings to the reader
+        registers using a single 0x10 command, skipping registers already
+        holding the value according to the register shadow.
+        Returns the number of registers written.
+        """
+        changed = [(addr, value) for addr, value in values
+                   if self.registers.get(addr) != value]
+        if not changed:
+            return 0
+        self.issue_evm_command(cmd='10', prms=''.join(addr + value for addr, value in changed),
+                               expected_records=0)
+        self.registers.update(changed)
+        return len(changed)
+
+    def reset_register_shadow(self):
+        """
+        Forgets the shadowed reader state, so that the next set_protocol()
+        call initializes the reader and writes all registers again.
+        """
+        self._initialized = False
+        self.registers = {}
+        self._agc = None
+        self._input_selection = None
+        self.protocol = None
 
     def enable_led(self, led_no):
-        cmd_codes = {2: 'FB', 3: 'F9', 4: 'F7', 5: 'F5', 6: 'F3'}
-        self.issue_iso15693_command(cmd=cmd_codes[led_no])
+        self.issue_iso15693_command(cmd=LED_ON_COMMANDS[led_no], expected_records=0)
 
     def disable_led(self, led_no):
-        cmd_codes = {2: 'FC', 3: 'FA', 4: 'F8', 5: 'F6', 6: 'F4'}
-        self.issue_iso15693_command(cmd=cmd_codes[led_no])
+        self.issue_iso15693_command(cmd=LED_OFF_COMMANDS[led_no], expected_records=0)
 
     def inventory(self, **kwargs):
+        """
+        Runs an inventory using the current protocol. Keyword arguments are
+        passed on to inventory_iso15693(), inventory_iso14443A() or
+        inventory_iso14443B().
+        """
         if self.protocol == ISO15693:
             return self.inventory_iso15693(**kwargs)
         elif self.protocol == ISO14443A:
             return self.inventory_iso14443A(**kwargs)
+        elif self.protocol == ISO14443B:
+            return self.inventory_iso14443B(**kwargs)
 
     def inventory_iso14443A(self):
         """
@@ -130,275 +452,652 @@ class PyRFIDGeek(object):
             <<< UID + BCC
 
         """
-        response = self.issue_evm_command(cmd='A0')
-
-        for itm in response:
-            iba = bytearray.fromhex(itm)
-            # Assume 4-byte UID + 1 byte Block Check Character (BCC)
-            if len(iba) != 5:
-                logger.warn('Encountered tag with UID of unknown length')
-                continue
-            if iba[0] ^ iba[1] ^ iba[2] ^ iba[3] ^ iba[4] != 0:
-                logger.warn('BCC check failed for tag')
-                continue
-            uid = itm[:8]  # hex string, so each byte is two chars
+        records = self.transceive(CMD_ISO14443A_ANTICOLLISION, expected_records=None)
 
-            logger.debug('Found tag: %s (%s) ', uid, itm[8:])
-            yield uid
+        for itm in records:
+            uid = iso14443a_uid(itm)
+            if uid is not None:
+                yield uid
 
             # See https://github.com/nfc-tools/libnfc/blob/master/examples/nfc-anticol.c
 
-    def inventory_iso15693(self, single_slot=False):
-        # Command code 0x01: ISO 15693 Inventory request
-        # Example: 010B000304 14 24 0100 0000
-        response = self.issue_iso15693_command(cmd='14',
-                                               flags=flagsbyte(inventory=True,
-                                                               single_slot=single_slot),
-                                               command_code='01',
-                                               data='00')
-        for itm in response:
-            itm = itm.split(',')
-            if itm[0] == 'z':
-                logger.debug('Tag conflict!')
-            else:
-                if len(itm[0]) == 16:
-                    uid = itm[0]
-                    logger.debug('Found tag: %s (%s) ', uid, itm[1])
-                    yield uid
+    def inventory_iso14443B(self, afi=0):
+        """
+        Sends a REQB through the 0xB0 EVM command and yields the PUPIs
+        (Pseudo-Unique PICC Identifiers) from the ATQBs received. Only cards
+        with application family `afi` answer, 0 means all cards.
 
-    def read_danish_model_tag(self, uid):
-        # Command code 0x23: Read multiple blocks
-        block_offset = 0
-        number_of_blocks = 8
-        response = self.issue_iso15693_command(cmd='18',
-                                               flags=flagsbyte(address=True),  # 32 (dec) <-> 20 (hex)
-                                               command_code='23',
-                                               data=uid + '%02X%02X' % (block_offset, number_of_blocks))
-
-        response = response[0]
-        if response == 'z':
-            return {'error': 'tag-conflict'}
-        elif response == '':
-            return {'error': 'read-failed'}
-
-        response = [response[i:i+2] for i in range(2, len(response), 2)]
-
-        if response[0] == '00':
-            is_blank = True
-        else:
-            is_blank = False
-
-        # Reference:
-        # RFID Data model for libraries : Doc 067 (July 2005), p. 30
-        # <http://www.biblev.no/RFID/dansk_rfid_datamodel.pdf>
-
-        # RFID Data model for libraries (February 2009), p. 30
-        # http://biblstandard.dk/rfid/dk/RFID_Data_Model_for_Libraries_February_2009.pdf
-        version = response[0][0]    # not sure if this is really the way to do it
-        if version != '0' and version != '1':
-            print(response)
-            return {'error': 'unknown-version: %s' % version}
-
-        usage_type = {
-            '0': 'acquisition',
-            '1': 'for-circulation',
-            '2': 'not-for-circulation',
-            '7': 'discarded',
-            '8': 'patron-card'
-        }[response[0][1]]  # not sure if this is really the way to do it
-
-        nparts = int(response[1], 16)
-        partno = int(response[2], 16)
-        itemid = ''.join([chr(int(x, 16)) for x in response[3:19]])
-        crc = response[19:21]
-        country = ''.join([chr(int(x, 16)) for x in response[21:23]])
-        library = ''.join([chr(int(x, 16)) for x in response[23:32]])
-
-        # CRC calculation:
-        p1 = response[0:19]     # 19 bytes
-        p2 = response[21:32]    # 11 bytes
-        p3 = ['00', '00']       # need to add 2 empty bytes to get 19 + 13 bytes
-        p = [int(x, 16) for x in p1 + p2 + p3]
-        calc_crc = ''.join(CRC().calculate(p)[::-1])
-        crc = ''.join(crc)
-
-        return {
-            'error': '',
-            'is_blank': is_blank,
-            'usage_type': usage_type,
-            'uid': uid,
-            'id': itemid.strip('\0'),
-            'partno': partno,
-            'nparts': nparts,
-            'country': country,
-            'library': library.strip('\0'),
-            'crc': crc,
-            'crc_ok': calc_crc == crc
-        }
+            >>> REQB (0x05, AFI, PARAM)
+            <<< ATQB (0x50, PUPI, application data, protocol info)
+        """
+        records = self.transceive(CMD_ISO14443B_REQUEST, struct.pack('BB', afi, 0),
+                                  expected_records=None)
+
+        for itm in records:
+            pupi = iso14443b_pupi(itm)
+            if pupi is not None:
+                yield pupi
+
+    def inventory_iso15693(self, single_slot=False, anticollision=False, afi=None, mask=0, mask_length=0):
+        """
+        Runs an ISO 15693 inventory and yields the UIDs found.
+
+        By default a single round of 16 slots (or 1 slot) is run, and tags
+        answering in the same slot are lost. With anticollision=True, every
+        colliding slot is resolved by re-issuing the inventory with the slot
+        number appended to the mask, until all slots resolve.
+
+        Only tags matching the filters answer, which means fewer collisions:
+        with `afi`, tags with that application family identifier (e.g.
+        AFI_SECURED); with `mask_length` > 0, tags whose UID ends with the
+        `mask_length` least significant bits of `mask`.
+
+        Statistics for the last inventory (rounds, frames, collisions) are
+        kept in `inventory_stats`.
+        """
+        inventory = ISO15693Inventory(single_slot, anticollision, afi, mask, mask_length, self.metrics)
+        self.inventory_stats = inventory.stats
+        for data in inventory.requests():
+            # Command code 0x01: ISO 15693 Inventory request
+            # Example: 010B000304 14 24 0100 0000
+            records = self.transceive_iso15693(CMD_ISO15693_INVENTORY,
+                                               inventory.flags_value,
+                                               0x01,
+                                               data,
+                                               expected_records=inventory.expected_records)
+            for uid in inventory.handle(records):
+                yield uid
+
+    def read_danish_model_tag(self, uid, cached=False):
+        """
+        Reads and decodes a tag following the Danish data model. With
+        cached=True, a previous successful read of the tag is returned if it
+        is still in `tag_cache`, without talking to the tag. The cached dict
+        is shared, so don't modify it. Entries are dropped when this object
+        writes to the tag or changes its AFI.
+        """
+        uid_bytes = binascii.unhexlify(uid)
+        item = self.tag_cache.get(uid_bytes) if cached else None
+        if item is None:
+            item = self._read_danish_model_tag(uid, uid_bytes)
+            if item['error']:
+                return item
+            self.tag_cache[uid_bytes] = item
+
+        if self.quiet_after_read:
+            # Read once, so keep it out of the following inventories
+            self.stay_quiet(uid)
+
+        return item
+
+    def _read_danish_model_tag(self, uid, uid_bytes):
+        error, response = self._read_memory(uid_bytes, 32)
+        if error:
+            return {'error': error}
+
+        item = decode_danish_model(uid, response)
+        if self.metrics is not None and not item.get('crc_ok', True) and not item.get('is_blank'):
+            self.metrics.inc('crc_failures_total')
+        return item
 
     def write_danish_model_tag(self, uid, data, max_attempts=20):
-        block_number = 0
-        blocks = []
-
-        data_bytes = ['00' for x in range(32)]
-        data_bytes[0] = '11'
-        data_bytes[1] = '%02X' % data['partno']
-        data_bytes[2] = '%02X' % data['nparts']
-        dokid = ['%02X' % ord(c) for c in data['id']]
-        data_bytes[3:3+len(dokid)] = dokid
-        data_bytes[21:23] = ['%02X' % ord(c) for c in data['country']]
-        libnr = ['%02X' % ord(c) for c in data['library']]
-        data_bytes[23:23+len(libnr)] = libnr
-
-        # CRC calculation:
-        p1 = data_bytes[0:19]     # 19 bytes
-        p2 = data_bytes[21:32]    # 11 bytes
-        p3 = ['00', '00']       # need to add 2 empty bytes to get 19 + 13 bytes
-        p = [int(x, 16) for x in p1 + p2 + p3]
-        crc = CRC().calculate(p)[::-1]
-        data_bytes[19:21] = crc
-
-        print(data_bytes)
-
-        for x in range(8):
-            print(data_bytes[x*4:x*4+4])
-            attempt = 1
-            while not self.write_block(uid, x, data_bytes[x*4:x*4+4]):
-                logger.warn('Attempt %d of %d: Write failed, retrying...' % (attempt, max_attempts))
-                if attempt >= max_attempts:
-                    return False
-                else:
-                    attempt += 1
-                    time.sleep(1.0)
-        return True
+        """
+        Writes an item tag. `data` is a dict with 'id', 'partno', 'nparts',
+        'country' and 'library', a danish.DanishRecord, or an already encoded
+        32-byte image (see bulk.py).
+        """
+        if isinstance(data, (bytes, bytearray)):
+            if len(data) != danish.RECORD_SIZE:
+                raise ValueError('Expected a %d-byte image, got %d bytes' % (danish.RECORD_SIZE, len(data)))
+            data_bytes = bytes(data)
+        else:
+            if not isinstance(data, danish.DanishRecord):
+                data = danish.DanishRecord(data['id'], data['country'], data['library'],
+                                           data['partno'], data['nparts'])
+            data_bytes = danish.encode(data)
+
+        logger.debug('Writing %s', binascii.hexlify(data_bytes))
+
+        return self.write_blocks(binascii.unhexlify(uid), data_bytes, max_attempts=max_attempts)
 
     def write_blocks_to_card(self, uid, data_bytes, offset=0, nblocks=8):
-        for x in range(offset, nblocks):
-            print(data_bytes[x*4:x*4+4])
-            success = False
-            attempts = 0
-            max_attempts = 10
-            while not success:
-                attempts += 1
-                success = self.write_block(uid, x, data_bytes[x*4:x*4+4])
-                if not success:
-                    logger.warn('Write failed, retrying')
-                    if attempts > max_attempts:
-                        logger.warn('Giving up!')
-                        return False
-                    # time.sleep(1.0)
-        return True
+        return self._write_blocks_to_card(binascii.unhexlify(uid),
+                                          bytearray.fromhex(''.join(data_bytes)),
+                                          offset, nblocks)
+
+    def _write_blocks_to_card(self, uid, data_bytes, offset=0, nblocks=8):
+        block_size = self._tag_info(uid).block_size
+        return self.write_blocks(uid, data_bytes[offset*block_size:nblocks*block_size], offset,
+                                 max_attempts=10, block_size=block_size)
+
+    def write_blocks(self, uid, data, offset=0, max_attempts=10, verify=True,
+                     backoff=0.01, max_backoff=0.2, block_size=None):
+        """
+        Writes `data` (bytes) to consecutive blocks starting at block `offset`
+        of the tag with UID `uid` (bytes). Returns True on success. The block
+        size is taken from the tag's system information unless given, and
+        `data` is padded with zeros to a whole number of blocks.
+
+        Runs of blocks are written with Write Multiple Blocks (0x24), falling
+        back to Write Single Block (0x21) for runs that fail. Tags for which
+        the fallback works get single block writes from then on. With verify=True, the blocks are then read back
+        with Read Multiple Blocks (0x23). Only the blocks that failed are
+        retried, waiting `backoff` seconds before the first retry and
+        doubling the wait for each retry, up to `max_backoff`.
+        """
+        bs = block_size or self._tag_info(uid).block_size
+        data = bytearray(data)
+        if len(data) % bs:
+            data += bytearray(bs - len(data) % bs)
+        nblocks = len(data) // bs
+        pending = list(range(nblocks))
+        delay = backoff
+        for attempt in range(1, max_attempts + 1):
+            failed = []
+            for first, count in _runs(pending, MAX_FRAME_DATA // bs):
+                if not self._write_run(uid, offset + first, data[first*bs:(first+count)*bs], bs):
+                    failed.extend(range(first, first + count))
+
+            if verify:
+                base = pending[0]
+                error, readback = self._read_memory(uid, (pending[-1] - base + 1) * bs,
+                                                    offset + base, bs)
+                if error:
+                    failed = pending
+                else:
+                    failed = [x for x in pending
+                              if readback[(x-base)*bs:(x-base+1)*bs] != data[x*bs:(x+1)*bs]]
+
+            if not failed:
+                return True
+            if attempt == max_attempts:
+                break
+            logger.warn('Attempt %d of %d: Writing %d block(s) failed, retrying...',
+                        attempt, max_attempts, len(failed))
+            if self.metrics is not None:
+                self.metrics.inc('write_retries_total')
+            pending = failed
+            time.sleep(delay)
+            delay = min(delay * 2, max_backoff)
+
+        logger.warn('Giving up!')
+        if self.metrics is not None:
+            self.metrics.inc('write_failures_total')
+        return False
+
+    def _write_run(self, uid, block_number, data, block_size):
+        # Writes a run of consecutive blocks, using a single frame if the tag
+        # supports it. If the multiple block write fails, for whatever reason
+        # (error, no answer), the blocks are written one by one instead, and
+        # if that works, the tag is assumed not to support Write Multiple
+        # Blocks.
+        nblocks = len(data) // block_size
+        multiple = nblocks > 1 and uid not in self._write_multiple_unsupported
+        if multiple:
+            result = self._write_multiple_blocks(uid, block_number, data, nblocks)
+            if result:
+                return True
+            logger.debug('Write multiple blocks %s, falling back to single block writes',
+                         'not supported' if result is None else 'failed')
+        success = True
+        for x in range(nblocks):
+            if not self._write_block(uid, block_number + x, data[x*block_size:(x+1)*block_size]):
+                success = False
+        if multiple and success:
+            self._write_multiple_unsupported.add(uid)
+        return success
+
+    def _write_multiple_blocks(self, uid, block_number, data, nblocks):
+        # Command code 0x24: Write multiple blocks
+        # Returns True/False, or None if the tag doesn't support the command.
+        self.tag_cache.pop(uid)
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x24,
+                                           uid + struct.pack('BB', block_number, nblocks - 1) + bytes(data),
+                                           expected_records=1)
+        if not records or not records[0]:
+            return False
+        payload = record_payload(records[0])
+        if payload[0] & 0x01 and len(payload) > 1 and payload[1] in ERROR_NOT_SUPPORTED:
+            return None
+        if payload[0] == 0:
+            logger.debug('Wrote blocks %d-%d successfully', block_number, block_number + nblocks - 1)
+            return True
+        return False
+
+    def _read_memory(self, uid, nbytes, block_number=0, block_size=None):
+        # Reads `nbytes` bytes starting at block `block_number`, using as few
+        # Read Multiple Blocks frames as the tag's memory layout allows.
+        # Returns (error, data), with an empty error string on success.
+        info = self._tag_info(uid)
+        bs = block_size or info.block_size
+        nblocks = min(-(-nbytes // bs), info.block_count - block_number)
+        if nblocks < 1:
+            return 'read-failed', None
+        per_frame = max(1, MAX_FRAME_DATA // bs)
+        data = bytearray()
+        for first in range(block_number, block_number + nblocks, per_frame):
+            error, chunk = self._read_blocks(uid, first, min(per_frame, block_number + nblocks - first))
+            if error:
+                return error, None
+            data += chunk
+        return '', data
+
+    def _read_blocks(self, uid, block_number, nblocks):
+        # Command code 0x23: Read multiple blocks
+        # Returns (error, data), with an empty error string on success.
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x23,
+                                           uid + struct.pack('BB', block_number, nblocks - 1),
+                                           expected_records=1)
+        if not records or records[0] == b'':
+            return 'read-failed', None
+        elif records[0] == b'z':
+            return 'tag-conflict', None
+        payload = record_payload(records[0])
+        if payload[0] != 0:
+            return 'read-failed', None
+        return '', payload[1:]     # skip the response flags
+
+    def is_present(self, uid):
+        """
+        Returns True if the tag answers an addressed request. Unlike an
+        inventory, this works for tags in quiet state, and leaves their state
+        unchanged.
+        """
+        # Command code 0x2B: Get system information. Any answer will do, even
+        # an error from tags not supporting it.
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x2B,
+                                           binascii.unhexlify(uid),
+                                           expected_records=1)
+        return bool(records) and records[0] not in (b'', b'z')
+
+    def get_system_information(self, uid):
+        """
+        Returns a TagInfo tuple with the memory layout, IC and AFI/DSFID of
+        the tag. The result is cached per UID, so only the first call for a
+        tag is sent to it. For tags not supporting Get System Information, a
+        layout of 8 blocks of 4 bytes is assumed.
+        """
+        return self._tag_info(binascii.unhexlify(uid))
+
+    def _tag_info(self, uid):
+        info = self.tag_info_cache.get(uid)
+        if info is None:
+            if self.query_system_information:
+                info = self._get_system_information(uid) or DEFAULT_TAG_INFO
+            else:
+                info = DEFAULT_TAG_INFO
+            self.tag_info_cache[uid] = info
+        return info
+
+    def _get_system_information(self, uid):
+        # Command code 0x2B: Get system information
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x2B,
+                                           uid,
+                                           expected_records=1)
+        if not records or records[0] in (b'', b'z'):
+            return None
+        payload = record_payload(records[0])
+        if payload[0] & 0x01 or len(payload) < 10:
+            return None
+
+        # Response: flags, info flags, UID (LSB first), and then the optional
+        # fields indicated by the info flags.
+        info_flags = payload[1]
+        ic_manufacturer = payload[8]
+        dsfid = afi = ic_reference = None
+        block_size, block_count = DEFAULT_TAG_INFO.block_size, DEFAULT_TAG_INFO.block_count
+        pos = 10
+        try:
+            if info_flags & 0x01:
+                dsfid = payload[pos]
+                pos += 1
+            if info_flags & 0x02:
+                afi = payload[pos]
+                pos += 1
+            if info_flags & 0x04:
+                block_count = payload[pos] + 1
+                block_size = (payload[pos + 1] & 0x1f) + 1
+                pos += 2
+            if info_flags & 0x08:
+                ic_reference = payload[pos]
+        except IndexError:
+            logger.warn('Truncated system information: %s', binascii.hexlify(payload))
+            return None
+        return TagInfo(dsfid, afi, block_size, block_count, ic_manufacturer, ic_reference)
 
     def erase_card(self, uid):
-        data_bytes = ['00' for x in range(32)]
-        return self.write_blocks_to_card(uid, data_bytes)
+        return self._write_blocks_to_card(binascii.unhexlify(uid), bytearray(32))
 
     def write_danish_model_patron_card(self, uid, data):
-        block_number = 0
-        blocks = []
-
-        data_bytes = ['00' for x in range(32)]
-
-        version = '1'
-        usage_type = '8'
-        data_bytes[0] = version + usage_type
-        data_bytes[1] = '01'  # partno
-        data_bytes[2] = '01'  # nparts
-        userid = ['%02X' % ord(c) for c in data['user_id']]
-        print('userid:', userid)
-        data_bytes[3:3+len(userid)] = userid
-        data_bytes[21:23] = ['%02X' % ord(c) for c in data['country']]
-        libnr = ['%02X' % ord(c) for c in data['library']]
-        data_bytes[23:23+len(libnr)] = libnr
-
-        # CRC calculation:
-        p1 = data_bytes[0:19]     # 19 bytes
-        p2 = data_bytes[21:32]    # 11 bytes
-        p3 = ['00', '00']       # need to add 2 empty bytes to get 19 + 13 bytes
-        p = [int(x, 16) for x in p1 + p2 + p3]
-        crc = CRC().calculate(p)[::-1]
-        data_bytes[19:21] = crc
-
-        print(data_bytes)
-
-        return self.write_blocks_to_card(uid, data_bytes)
+        data_bytes = danish.encode(danish.DanishRecord(data['user_id'], data['country'], data['library'],
+                                                       usage_type='patron-card'))
+
+        logger.debug('Writing %s', binascii.hexlify(data_bytes))
+
+        return self._write_blocks_to_card(binascii.unhexlify(uid), data_bytes)
 
     def write_block(self, uid, block_number, data):
         if type(data) != list or len(data) != 4:
-            raise StandardError('write_block got data of unknown type/length')
-
-        response = self.issue_iso15693_command(cmd='18',
-                                               flags=flagsbyte(address=True),  # 32 (dec) <-> 20 (hex)
-                                               command_code='21',
-                                               data='%s%02X%s' % (uid, block_number, ''.join(data)))
-        if response[0] == '00':
+            raise ValueError('write_block got data of unknown type/length')
+
+        return self._write_block(binascii.unhexlify(uid), block_number, bytearray.fromhex(''.join(data)))
+
+    def _write_block(self, uid, block_number, data):
+        # Command code 0x21: Write single block
+        self.tag_cache.pop(uid)
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x21,
+                                           uid + struct.pack('B', block_number) + bytes(data),
+                                           expected_records=1)
+        if records and records[0] == b'00':
             logger.debug('Wrote block %d successfully', block_number)
             return True
         else:
             return False
 
     def unlock_afi(self, uid):
-        self.issue_iso15693_command(cmd='18',
-                                    flags=flagsbyte(address=False,
-                                                    high_data_rate=True,
-                                                    option=False),  # 32 (dec) <-> 20 (hex)
-                                    command_code='27',
-                                    data='C2')
+        """
+        Sets the AFI of the tag to AFI_UNSECURED (checked out). Returns True
+        on success.
+        """
+        return self.write_afi(uid, AFI_UNSECURED)
 
     def lock_afi(self, uid):
-        self.issue_iso15693_command(cmd='18',
-                                    flags=flagsbyte(address=False,
-                                                    high_data_rate=False,
-                                                    option=False),  # 32 (dec) <-> 20 (hex)
-                                    command_code='27',
-                                    data='07')
-
-    def issue_evm_command(self, cmd, prms=''):
-        # The EVM protocol has a general form as shown below:
-        #  1. SOF (Start of File): 0x01
-        #  2. LENGTH : Two bytes define the number of bytes in the frame including SOF. Least Significant Byte first!
-        #  3. READER_TYPE : 0x03
-        #  4. ENTITY : 0x04
-        #  5. CMD : The command
-        #  6. PRMS : Parameters
-        #  7. EOF : 0x0000
-
-        # Two-digit hex strings (without 0x prefix)
-        sof = '01'
-        reader_type = '03'
-        entity = '04'
-        eof = '0000'
-
-        result = reader_type + entity + cmd + prms + eof
-
-        length = int(len(result)/2) + 3  # Number of *bytes*, + 3 to include SOF and LENGTH
-        length = '%04X' % length  # Convert int to hex
-        length = binascii.unhexlify(length)[::-1]  # Reverse hex string to get LSB first
-        length = binascii.hexlify(length).decode('ascii')
-
-        result = sof + length + result
-
-        self.write(result)
-        response = self.read()
-        return self.get_response(response)
-
-    def issue_iso15693_command(self, cmd, flags='', command_code='', data=''):
-        return self.issue_evm_command(cmd, flags + command_code + data)
+        """
+        Sets the AFI of the tag to AFI_SECURED (checked in). Returns True on
+        success.
+        """
+        return self.write_afi(uid, AFI_SECURED)
+
+    def write_afi(self, uid, afi):
+        """
+        Writes the AFI of a single tag. Returns True if the tag acknowledged
+        the write.
+        """
+        return self._write_afi(binascii.unhexlify(uid), afi)
+
+    def _write_afi(self, uid, afi):
+        self.tag_info_cache.pop(uid)
+        self.tag_cache.pop(uid)
+        # Command code 0x27: Write AFI
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x27,
+                                           uid + struct.pack('B', afi),
+                                           expected_records=1)
+        return bool(records) and records[0] == b'00'
+
+    def write_afi_batch(self, afi, uids=None, max_attempts=5, verify=True, backoff=0.01):
+        """
+        Sets the AFI of many tags, e.g. AFI_UNSECURED for all items in a
+        stack being checked out. `uids` defaults to the tags found by an
+        inventory. Each tag is addressed individually, and only the tags that
+        failed are retried, up to `max_attempts` times.
+
+        The new value is verified according to `verify`:
+        - True or 'system_information': read back from each tag with Get
+          System Information (for tags not supporting it, the
+          acknowledgement of the write is trusted).
+        - 'inventory': a single inventory filtered on the new AFI, which
+          all the tags written must answer.
+        - False: the acknowledgement of the write is trusted.
+
+        Returns a dict mapping each UID to True (success) or False.
+        """
+        if uids is None:
+            uids = list(self.inventory(anticollision=True) or ())
+        results = dict((uid, False) for uid in uids)
+        pending = list(results)
+        for attempt in range(1, max_attempts + 1):
+            written = []
+            for uid in pending:
+                uid_bytes = binascii.unhexlify(uid)
+                ok = self._write_afi(uid_bytes, afi)
+                if ok and verify and verify != 'inventory':
+                    info = self._get_system_information(uid_bytes)
+                    if info is not None and info.afi is not None:
+                        self.tag_info_cache[uid_bytes] = info
+                        ok = info.afi == afi
+                if ok:
+                    written.append(uid)
+            if verify == 'inventory' and written:
+                found = set(self.inventory_iso15693(anticollision=True, afi=afi))
+                written = [uid for uid in written if uid in found]
+            for uid in written:
+                results[uid] = True
+            failed = [uid for uid in pending if not results[uid]]
+            if not failed:
+                break
+            logger.warn('Attempt %d of %d: Writing AFI failed for %d tag(s)',
+                        attempt, max_attempts, len(failed))
+            pending = failed
+            if attempt < max_attempts:
+                time.sleep(backoff)
+        return results
+
+    def stay_quiet(self, uid):
+        """
+        Puts the tag in quiet state, in which it doesn't answer inventory or
+        other non-addressed requests until it is reset to ready, selected or
+        leaves the field. Addressed requests still work.
+        """
+        # Command code 0x02: Stay quiet. The tag does not answer.
+        self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                 FLAGS_ADDRESSED,
+                                 0x02,
+                                 binascii.unhexlify(uid),
+                                 expected_records=0)
+        self.quieted_uids.add(uid)
+
+    def select(self, uid):
+        """
+        Puts the tag in selected state. Returns True on success.
+        """
+        # Command code 0x25: Select
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x25,
+                                           binascii.unhexlify(uid),
+                                           expected_records=1)
+        if records and records[0] == b'00':
+            self.quieted_uids.discard(uid)
+            return True
+        return False
+
+    def reset_to_ready(self, uid=None):
+        """
+        Returns the tag to ready state. Without a uid, the request is sent
+        non-addressed, which only reaches tags in ready or selected state:
+        tags in quiet state only process addressed requests (ISO 15693-3),
+        so they have to be reset one by one. The answers to the non-addressed
+        request are likely to collide, so they are not checked.
+        """
+        # Command code 0x26: Reset to ready
+        if uid is None:
+            self.transceive_iso15693(CMD_ISO15693_REQUEST, flags(), 0x26, expected_records=0)
+            return True
+        records = self.transceive_iso15693(CMD_ISO15693_REQUEST,
+                                           FLAGS_ADDRESSED,
+                                           0x26,
+                                           binascii.unhexlify(uid),
+                                           expected_records=1)
+        if records and records[0] == b'00':
+            self.quieted_uids.discard(uid)
+            return True
+        return False
+
+    @contextmanager
+    def quiet_session(self):
+        """
+        Incremental inventory of a growing stack of tags: within the session,
+        tags are put to quiet state once they have been read by
+        read_danish_model_tag(), so following inventories only report tags
+        not read yet. When the session ends, each tag put to quiet state is
+        reset to ready with an addressed request.
+
+            with rfid.quiet_session():
+                while scanning:
+                    for uid in rfid.inventory():
+                        item = rfid.read_danish_model_tag(uid)
+        """
+        self.quiet_after_read = True
+        try:
+            yield self
+        finally:
+            self.quiet_after_read = False
+            for uid in list(self.quieted_uids):
+                if not self.reset_to_ready(uid):
+                    # Most likely the tag has left the field, and it powers
+                    # up in ready state when it comes back
+                    logger.debug('Unable to reset %s to ready', uid)
+                    self.quieted_uids.discard(uid)
+
+    def issue_evm_command(self, cmd, prms='', expected_records=None):
+        """
+        Sends EVM command `cmd` with parameters `prms`, both as hex strings,
+        and returns the records of the reply as a list of strings.
+        By default, the reply is read until the board has been silent for
+        `timeout` seconds; pass `expected_records` to return as soon as the
+        reply is complete, see read(). See transceive() for the binary
+        version.
+        """
+        records = self.transceive(int(cmd, 16), binascii.unhexlify(prms), expected_records)
+        return [record.decode('ascii') for record in records]
+
+    def issue_iso15693_command(self, cmd, flags='', command_code='', data='', expected_records=None):
+        return self.issue_evm_command(cmd, flags + command_code + data, expected_records)
+
+    def transceive(self, cmd, prms=b'', expected_records=0):
+        """
+        Sends EVM command `cmd` (int) with parameters `prms` (bytes) and
+        returns the records of the reply as a list of bytes.
+        """
+        return self.transceive_frame(build_frame(cmd, prms), cmd, expected_records)
+
+    def transceive_iso15693(self, cmd, flags_value, command_code, data=b'', expected_records=1):
+        """
+        Sends an ISO 15693 request through EVM command `cmd` (0x14 for
+        inventory, 0x18 for other requests) and returns the records of the
+        reply as a list of bytes.
+        """
+        return self.transceive_frame(build_iso15693_frame(cmd, flags_value, command_code, data),
+                                     cmd, expected_records)
+
+    def transceive_frame(self, frame, cmd, expected_records=0):
+        if self.frame_lock is not None:
+            with self.frame_lock:
+                return self._transceive_frame(frame, cmd, expected_records)
+        return self._transceive_frame(frame, cmd, expected_records)
+
+    def _transceive_frame(self, frame, cmd, expected_records):
+        t0 = monotonic()
+        self.write_frame(frame)
+        response = self.read(expected_records)
+        elapsed = monotonic() - t0
+        self.record_round_trip(HEX_BYTES[cmd], elapsed)
+        if self.metrics is not None:
+            labels = (('cmd', HEX_BYTES[cmd]),)
+            self.metrics.inc('frames_sent_total', labels=labels)
+            self.metrics.inc('bytes_sent_total', 2 * len(frame))
+            self.metrics.inc('bytes_received_total', len(response))
+            self.metrics.observe('round_trip_seconds', elapsed, labels)
+        if self.trace is not None:
+            self.trace(FrameTrace(cmd, frame, response, elapsed))
+        return parse_records(response)
+
+    def record_round_trip(self, cmd, elapsed):
+        self.last_round_trip = elapsed
+        stats = self._round_trips.get(cmd)
+        if stats is None:
+            self._round_trips[cmd] = [1, elapsed, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed < stats[2]:
+                stats[2] = elapsed
+            if elapsed > stats[3]:
+                stats[3] = elapsed
+        logger.debug('Command %s round trip: %.1f ms', cmd, elapsed * 1000.)
+
+    def round_trip_stats(self):
+        """
+        Returns round-trip latency statistics (in seconds) per EVM command
+        code, measured from the frame being written until the reply has been
+        read completely.
+        """
+        return {cmd: {'count': count,
+                      'mean': total / count,
+                      'min': tmin,
+                      'max': tmax}
+                for cmd, (count, total, tmin, tmax) in self._round_trips.items()}
 
     def flush(self):
         self.sp.readall()
 
     def write(self, msg):
-        logger.debug('SEND%3d: ' % (len(msg)/2) + msg[0:10] + colored(msg[10:12], attrs=['underline']) + msg[12:14] + colored(msg[14:], 'green'))
-        self.sp.write(msg.encode('ascii'))
+        self.write_frame(decode_frame(msg))
+
+    def write_frame(self, frame):
+        msg = encode_frame(frame)
+        if self.sp.in_waiting:
+            # Left-overs from a previous reply would be mistaken for (part of)
+            # the reply to this command.
+            stale = self.sp.read(self.sp.in_waiting)
+            logger.debug('Discarding %d stale bytes: %r', len(stale), stale)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('SEND%3d: %s', len(frame), _format_sent(msg.decode('ascii')))
+        self.sp.write(msg)
+
+    def read(self, expected_records=None):
+        """
+        Reads a reply from the board, returning as soon as it is complete:
 
-    def read(self):
-        msg = self.sp.readall()
-        logger.debug('RETR%3d: ' % (len(msg)/2) + colored(pprint.saferepr(msg).strip("'"), 'cyan'))
+        - expected_records > 0: when that many bracketed records have been
+          received, followed by a line break.
+        - expected_records == 0: when a line break has been followed by
+          `idle_timeout` seconds of silence.
+        - expected_records is None: when nothing has been received for
+          `timeout` seconds.
+
+        In any case, `timeout` seconds of silence ends the reply.
+        """
+        sp = self.sp
+        buf = bytearray()
+        last = monotonic()
+        while True:
+            waiting = sp.in_waiting
+            if waiting:
+                buf += sp.read(waiting)
+                last = monotonic()
+                if expected_records and reply_complete(buf, expected_records):
+                    break
+                continue
+            idle = monotonic() - last
+            if idle >= self.timeout:
+                if expected_records:
+                    logger.debug('Timeout waiting for %d records', expected_records)
+                    if self.metrics is not None:
+                        self.metrics.inc('timeouts_total')
+                break
+            if expected_records == 0 and idle >= self.idle_timeout and buf.endswith(b'\n'):
+                break
+            time.sleep(self.poll_interval)
+        msg = bytes(buf)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('RETR%3d: %s', len(msg) // 2, _format_received(msg))
         return msg
 
     def get_response(self, response):
-        return re.findall(r'\[(.*?)\]', response.decode('ascii'))
+        return [record.decode('ascii') for record in parse_records(response)]
 
     def close(self):
         self.sp.close()
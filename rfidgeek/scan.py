@@ -0,0 +1,147 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import logging
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from .rfidgeek import ISO15693, ISO14443A
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {ISO15693: 10, ISO14443A: 1}
+
+
+class ProtocolScanner(object):
+    """
+    Shares the reader's airtime between several protocols:
+
+        scanner = ProtocolScanner(rfid, weights={ISO15693: 10, ISO14443A: 1},
+                                  revisit={ISO14443A: 2.0})
+        for protocol, uids in scanner.scan():
+            ...
+
+    Each protocol gets airtime in proportion to its weight (stride
+    scheduling): every inventory is charged its measured duration, including
+    the protocol switch before it, divided by the weight. This matters since
+    inventory times differ a lot between protocols: an ISO 15693 round takes
+    a few milliseconds, while the ISO 14443 inventories wait for the full
+    reply timeout. A protocol that found tags within the last `hit_window`
+    seconds has its weight multiplied by `hit_boost`, so a patron card that
+    was just put down is followed closely. `revisit` bounds how long (in
+    seconds) a protocol can go without an inventory, whatever the weights.
+
+    Protocol switches cost airtime too, so the current protocol is kept as
+    long as its next inventory doesn't take it more than `switch_penalty`
+    switches' worth of airtime past its share. A protocol with long
+    inventories thus never gets an extra one because of this.
+
+    `inventory_kwargs` maps protocols to keyword arguments for inventory(),
+    e.g. {ISO15693: {'anticollision': True}}.
+    """
+
+    def __init__(self, reader, weights=None, revisit=None, hit_boost=4.0, hit_window=10.0,
+                 switch_penalty=1.0, inventory_kwargs=None):
+        self.reader = reader
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.revisit = dict(revisit or {})
+        self.hit_boost = hit_boost
+        self.hit_window = hit_window
+        self.switch_penalty = switch_penalty
+        self.inventory_kwargs = dict(inventory_kwargs or {})
+
+        self.protocols = sorted(self.weights)
+        self.passes = dict((p, 0.0) for p in self.protocols)
+        self.last_scan = dict((p, None) for p in self.protocols)
+        self.last_hit = dict((p, None) for p in self.protocols)
+        self.counts = dict((p, 0) for p in self.protocols)
+        self.airtime = dict((p, 0.0) for p in self.protocols)
+        self.durations = dict((p, None) for p in self.protocols)   # last inventory time
+        self.switch_time = 0.0      # last measured protocol switch time
+        self.switches = 0
+        self.current = None
+
+    def weight(self, protocol, now=None):
+        """
+        Returns the effective weight of `protocol`, including the hit boost.
+        """
+        if now is None:
+            now = monotonic()
+        weight = float(self.weights[protocol])
+        last_hit = self.last_hit[protocol]
+        if last_hit is not None and now - last_hit < self.hit_window:
+            weight *= self.hit_boost
+        return weight
+
+    def next_protocol(self, now=None):
+        """
+        Returns the protocol to run the next inventory with.
+        """
+        if now is None:
+            now = monotonic()
+
+        # Protocols that are due for a revisit come first, most overdue first
+        overdue = []
+        for protocol in self.protocols:
+            limit = self.revisit.get(protocol)
+            last_scan = self.last_scan[protocol]
+            if limit is not None and (last_scan is None or now - last_scan >= limit):
+                overdue.append((-(now - last_scan) if last_scan is not None else float('-inf'), protocol))
+        if overdue:
+            return min(overdue)[1]
+
+        candidates = [p for p in self.protocols if self.weights[p] > 0]
+        if not candidates:
+            # No weights at all, so just take turns
+            return min(self.protocols, key=lambda p: self.last_scan[p] or 0)
+        best = min(candidates, key=lambda p: (self.passes[p], p))
+        current = self.current
+        if current in candidates and current != best and self.durations[current] is not None:
+            weight = self.weight(current, now)
+            cost = self.durations[current] / weight
+            allowance = self.switch_penalty * self.switch_time / weight
+            if self.passes[current] + cost <= self.passes[best] + allowance:
+                return current
+        return best
+
+    def scan_once(self):
+        """
+        Runs one inventory with the next protocol and returns
+        (protocol, list of UIDs).
+        """
+        started = monotonic()
+        protocol = self.next_protocol(started)
+        switched = protocol != self.current
+        if switched:
+            self.switches += 1
+            self.current = protocol
+        self.reader.set_protocol(protocol)
+        switched_at = monotonic()
+        if switched:
+            self.switch_time = switched_at - started
+        uids = list(self.reader.inventory(**self.inventory_kwargs.get(protocol, {})) or ())
+
+        now = monotonic()
+        self.durations[protocol] = now - switched_at
+        self.airtime[protocol] += now - started
+        self.last_scan[protocol] = now
+        if uids:
+            self.last_hit[protocol] = now
+        self.counts[protocol] += 1
+        if self.weights[protocol] > 0:
+            self.passes[protocol] += (now - started) / self.weight(protocol, now)
+        return protocol, uids
+
+    def scan(self):
+        """
+        Generator running inventories forever, yielding (protocol, UIDs).
+        """
+        while True:
+            yield self.scan_once()
+
+    def stats(self):
+        return {'inventories': dict(self.counts), 'airtime': dict(self.airtime), 'switches': self.switches}
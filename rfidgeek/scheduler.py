@@ -0,0 +1,133 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Priority classes, lower values are served first
+PRIORITY_USER = 0           # user-initiated operations, such as writes
+PRIORITY_NORMAL = 5
+PRIORITY_BACKGROUND = 10    # background inventory scans
+
+
+class PriorityLock(object):
+    """
+    A reentrant lock that hands the lock to waiting threads in priority order
+    (lowest value first), and in arrival order within a priority.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._count = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is me:
+                self._count += 1
+                return True
+            entry = (priority, next(self._seq), me)
+            heapq.heappush(self._waiters, entry)
+            try:
+                while self._owner is not None or self._waiters[0] is not entry:
+                    self._cond.wait()
+            except BaseException:
+                # E.g. KeyboardInterrupt: give up our place in the queue, so
+                # the threads behind us don't wait for us forever
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self._owner = me
+            self._count = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._owner is not threading.current_thread():
+                raise RuntimeError('Cannot release a lock owned by another thread')
+            self._count -= 1
+            if self._count == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+
+class CommandScheduler(object):
+    """
+    Serializes access to a PyRFIDGeek shared by several threads.
+
+    Every frame sent by the reader is sent while holding a priority lock, so
+    frames from different threads never interleave, and a waiting
+    high-priority thread gets the port as soon as the current frame is done.
+    Multi-frame operations that must not be interrupted run in a
+    transaction:
+
+        scheduler = CommandScheduler(rfid)
+
+        # Scanner thread
+        with scheduler.priority(PRIORITY_BACKGROUND):
+            uids = list(rfid.inventory())
+
+        # Another thread
+        with scheduler.transaction(PRIORITY_USER):
+            rfid.write_danish_model_patron_card(uid, data)
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.lock = PriorityLock()
+        self._local = threading.local()
+        reader.frame_lock = self
+
+    def current_priority(self):
+        return getattr(self._local, 'priority', PRIORITY_NORMAL)
+
+    @contextmanager
+    def priority(self, priority):
+        """
+        Sets the priority of the frames sent by the current thread.
+        """
+        previous = self.current_priority()
+        self._local.priority = priority
+        try:
+            yield self.reader
+        finally:
+            self._local.priority = previous
+
+    @contextmanager
+    def transaction(self, priority=PRIORITY_NORMAL):
+        """
+        Gives the current thread exclusive use of the reader for the duration
+        of the block.
+        """
+        with self.priority(priority):
+            self.lock.acquire(priority)
+            try:
+                yield self.reader
+            finally:
+                self.lock.release()
+
+    def call(self, priority, func, *args, **kwargs):
+        """
+        Calls `func(*args, **kwargs)` in a transaction and returns the result.
+        """
+        with self.transaction(priority):
+            return func(*args, **kwargs)
+
+    # Used by PyRFIDGeek around each frame
+
+    def __enter__(self):
+        self.lock.acquire(self.current_priority())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock.release()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Simulated TRF7970A EVM board, for testing and benchmarking without hardware.
+#
+#   sim = SimulatedReader(make_population(20, seed=1), seed=1)
+#   rfid = PyRFIDGeek(serial_port=None, transport=sim)
+#
+# The simulator implements the parts of the serial port interface used by
+# PyRFIDGeek, speaks the EVM framing, and models ISO 15693 tags (inventory
+# with slots and masks, quiet/selected states, block reads and writes, AFI,
+# system information) and ISO 14443A/B cards (UIDs/PUPIs only). All randomness comes
+# from a seeded random.Random, so runs are reproducible.
+
+import binascii
+import random
+import struct
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from .danish import DanishRecord, encode
+from .frame import (parse_frame, decode_frame, INVENTORY_MASK, CMD_REGISTER_WRITE,
+                    CMD_ISO15693_INVENTORY, CMD_ISO15693_REQUEST, CMD_ISO14443A_ANTICOLLISION,
+                    CMD_ISO14443B_REQUEST, CMD_INITIALIZE)
+from .rfidgeek import ISO15693, ISO14443A, ISO14443B, ISO_CONTROL, ISO_CONTROL_VALUES
+from .transport import QueuedTransport
+
+READY = 'ready'
+QUIET = 'quiet'
+SELECTED = 'selected'
+
+# ISO 15693 error codes
+ERROR_NOT_SUPPORTED = 0x01
+ERROR_BLOCK_NOT_AVAILABLE = 0x10
+
+
+class SimulatedTag(object):
+    """
+    A tag in the field of a SimulatedReader. `uid` is a hex string, as
+    reported by inventory.
+    """
+
+    def __init__(self, uid, protocol=ISO15693, memory=None, block_size=4, block_count=8,
+                 afi=0, dsfid=0, ic_reference=0x01, write_multiple=True, system_information=True):
+        self.uid = uid
+        self.protocol = protocol
+        self.block_size = block_size
+        self.block_count = block_count
+        self.memory = bytearray(block_size * block_count)
+        if memory is not None:
+            self.memory[:len(memory)] = memory
+        self.afi = afi
+        self.dsfid = dsfid
+        self.ic_reference = ic_reference
+        self.write_multiple = write_multiple
+        self.system_information = system_information
+        self.state = READY
+
+    @property
+    def uid_bytes(self):
+        return binascii.unhexlify(self.uid)
+
+    @property
+    def uid_value(self):
+        return int(self.uid, 16)
+
+    def __repr__(self):
+        return '<SimulatedTag %s (%s)>' % (self.uid, self.protocol)
+
+
+def danish_model_memory(item_id, partno=1, nparts=1, country='NO', library='1030310',
+                        usage_type='for-circulation'):
+    """
+    Returns the 32-byte memory of a tag following the Danish data model.
+    """
+    return bytearray(encode(DanishRecord(item_id, country, library, partno, nparts, usage_type)))
+
+
+def make_population(n, seed=0, iso14443a=0, blank=0, iso14443b=0):
+    """
+    Returns `n` ISO 15693 tags with Danish data model memory (the first
+    `blank` of them blank), `iso14443a` ISO 14443A cards and `iso14443b`
+    ISO 14443B cards, with UIDs drawn from a random generator seeded with
+    `seed`.
+    """
+    rng = random.Random(seed)
+    tags = []
+    for i in range(n):
+        uid = '%016X' % (0xE004010000000000 | rng.getrandbits(40))
+        memory = None if i < blank else danish_model_memory('%09d' % rng.randrange(10 ** 9))
+        tags.append(SimulatedTag(uid, memory=memory))
+    for i in range(iso14443a):
+        tags.append(SimulatedTag('%08X' % rng.getrandbits(32), protocol=ISO14443A))
+    for i in range(iso14443b):
+        tags.append(SimulatedTag('%08X' % rng.getrandbits(32), protocol=ISO14443B))
+    return tags
+
+
+def _afi_matches(afi, tag_afi):
+    # A zero family or subfamily in the request matches any (ISO 15693-3)
+    return ((afi >> 4 == 0 or afi >> 4 == tag_afi >> 4) and
+            (afi & 0x0f == 0 or afi & 0x0f == tag_afi & 0x0f))
+
+
+class SimulatedReader(QueuedTransport):
+    """
+    Serial port stand-in simulating an RFIDGeek board with `tags` in its
+    field (a list of SimulatedTag objects that can be changed at any time).
+
+    latency:             seconds before the reply to a frame becomes available
+    collision_rate:      probability that a slot with a single tag is
+                         reported as a collision anyway (RF noise)
+    write_failure_rate:  probability that a block write fails
+    """
+
+    def __init__(self, tags=None, seed=0, latency=0.0, collision_rate=0.0, write_failure_rate=0.0):
+        super(SimulatedReader, self).__init__()
+        self.tags = list(tags or [])
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.collision_rate = collision_rate
+        self.write_failure_rate = write_failure_rate
+        self.protocol = None
+        self.registers = {}
+        self.frames = 0
+        self.is_open = True
+        self.portstr = 'sim://'
+        self.timeout = None
+
+    # Serial port interface
+
+    def write(self, msg):
+        self.frames += 1
+        reply = self.handle(decode_frame(bytes(msg)))
+        self._queue(reply, monotonic() + self.latency)
+        return len(msg)
+
+    def close(self):
+        self.is_open = False
+
+    # EVM
+
+    def handle(self, frame):
+        """
+        Returns the reply to a binary frame.
+        """
+        cmd, prms = parse_frame(frame)
+        prms = bytearray(prms)
+        if cmd == CMD_INITIALIZE:
+            return b'TRF7970A EVM\r\n'
+        elif cmd == CMD_REGISTER_WRITE:
+            for i in range(0, len(prms) - 1, 2):
+                self.registers['%02X' % prms[i]] = '%02X' % prms[i + 1]
+            iso_control = self.registers.get(ISO_CONTROL)
+            self.protocol = dict((v, k) for k, v in ISO_CONTROL_VALUES.items()).get(iso_control)
+            return b'Register write request.\r\n'
+        elif cmd == CMD_ISO15693_INVENTORY:
+            return self._records(self.iso15693_inventory(prms))
+        elif cmd == CMD_ISO15693_REQUEST:
+            return self._records(self.iso15693_request(prms))
+        elif cmd == CMD_ISO14443A_ANTICOLLISION:
+            return self._records(self.iso14443a_anticollision())
+        elif cmd == CMD_ISO14443B_REQUEST:
+            return self._records(self.iso14443b_request(prms))
+        return b'\r\n'
+
+    def _records(self, records):
+        return b''.join(b'[' + r + b']\r\n' for r in records)
+
+    def _field(self, protocol):
+        if self.protocol != protocol:
+            return []
+        return [tag for tag in self.tags if tag.protocol == protocol]
+
+    def iso15693_inventory(self, prms):
+        flags = prms[0]
+        data = prms[2:]
+        single_slot = flags & 0x20
+        if flags & 0x10:    # AFI flag
+            afi, data = data[0], data[1:]
+        else:
+            afi = None
+        mask_length = data[0]
+        mask = INVENTORY_MASK.unpack(bytes(data[:1 + (mask_length + 7) // 8]).ljust(9, b'\0'))[1]
+
+        nslots = 1 if single_slot else 16
+        slots = [[] for _ in range(nslots)]
+        for tag in self._field(ISO15693):
+            if tag.state == QUIET:
+                continue
+            if afi and not _afi_matches(afi, tag.afi):
+                continue
+            uid = tag.uid_value
+            if uid & ((1 << mask_length) - 1) != mask:
+                continue
+            slot = 0 if single_slot else (uid >> mask_length) & 0x0f
+            slots[slot].append(tag)
+
+        records = []
+        for slot in slots:
+            if len(slot) > 1 or (slot and self.collision_rate and self.rng.random() < self.collision_rate):
+                records.append(b'z')
+            elif slot:
+                records.append(slot[0].uid.encode('ascii') + b',5A')
+            else:
+                records.append(b'')
+        return records
+
+    def iso15693_request(self, prms):
+        flags, command_code = prms[0], prms[1]
+        data = prms[2:]
+        if flags & 0x20:    # Addressed
+            uid, data = bytes(data[:8]), data[8:]
+            targets = [tag for tag in self._field(ISO15693) if tag.uid_bytes == uid]
+        elif flags & 0x10:  # Selected
+            targets = [tag for tag in self._field(ISO15693) if tag.state == SELECTED]
+        else:
+            targets = [tag for tag in self._field(ISO15693) if tag.state != QUIET]
+
+        if not targets:
+            return [b'']
+        if len(targets) > 1:
+            for tag in targets:
+                self._execute(tag, command_code, data)
+            return [b'z']
+        response = self._execute(targets[0], command_code, data)
+        if response is None:
+            # The board reports an empty record when the tag doesn't answer
+            return [b'']
+        return [binascii.hexlify(response).upper()]
+
+    def _execute(self, tag, command_code, data):
+        # Returns the tag's response (bytes), or None if it doesn't answer
+        bs = tag.block_size
+        if command_code == 0x02:    # Stay quiet
+            tag.state = QUIET
+            return None
+        elif command_code == 0x20:  # Read single block
+            block = data[0]
+            if block >= tag.block_count:
+                return bytearray([0x01, ERROR_BLOCK_NOT_AVAILABLE])
+            return b'\x00' + bytes(tag.memory[block*bs:(block+1)*bs])
+        elif command_code == 0x21:  # Write single block
+            block = data[0]
+            if block >= tag.block_count:
+                return bytearray([0x01, ERROR_BLOCK_NOT_AVAILABLE])
+            if self.rng.random() < self.write_failure_rate:
+                return b''
+            tag.memory[block*bs:(block+1)*bs] = data[1:1 + bs]
+            return b'\x00'
+        elif command_code == 0x23:  # Read multiple blocks
+            first, count = data[0], data[1] + 1
+            if first + count > tag.block_count:
+                return bytearray([0x01, ERROR_BLOCK_NOT_AVAILABLE])
+            return b'\x00' + bytes(tag.memory[first*bs:(first+count)*bs])
+        elif command_code == 0x24:  # Write multiple blocks
+            if not tag.write_multiple:
+                return bytearray([0x01, ERROR_NOT_SUPPORTED])
+            first, count = data[0], data[1] + 1
+            if first + count > tag.block_count:
+                return bytearray([0x01, ERROR_BLOCK_NOT_AVAILABLE])
+            if self.rng.random() < self.write_failure_rate:
+                return b''
+            tag.memory[first*bs:(first+count)*bs] = data[2:2 + count*bs]
+            return b'\x00'
+        elif command_code == 0x25:  # Select
+            for other in self.tags:
+                if other.state == SELECTED:
+                    other.state = READY
+            tag.state = SELECTED
+            return b'\x00'
+        elif command_code == 0x26:  # Reset to ready
+            tag.state = READY
+            return b'\x00'
+        elif command_code == 0x27:  # Write AFI
+            if self.rng.random() < self.write_failure_rate:
+                return b''
+            tag.afi = data[0]
+            return b'\x00'
+        elif command_code == 0x2B:  # Get system information
+            if not tag.system_information:
+                return bytearray([0x01, ERROR_NOT_SUPPORTED])
+            return (b'\x00\x0F' + tag.uid_bytes[::-1] +
+                    struct.pack('BBBBB', tag.dsfid, tag.afi, tag.block_count - 1,
+                                tag.block_size - 1, tag.ic_reference))
+        return bytearray([0x01, ERROR_NOT_SUPPORTED])
+
+    def iso14443a_anticollision(self):
+        records = []
+        for tag in self._field(ISO14443A):
+            uid = bytearray(tag.uid_bytes)
+            bcc = uid[0] ^ uid[1] ^ uid[2] ^ uid[3]
+            records.append(tag.uid.encode('ascii') + b'%02X' % bcc)
+        return records
+
+    def iso14443b_request(self, prms):
+        afi = prms[0] if prms else 0
+        cards = [tag for tag in self._field(ISO14443B) if not afi or tag.afi == afi]
+        if len(cards) > 1:
+            return [b'z']
+        # ATQB: 0x50, PUPI, application data, protocol info
+        return [b'50' + tag.uid.encode('ascii') + b'00000000' + b'808171' for tag in cards]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+
+from collections import deque
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+
+class QueuedTransport(object):
+    """
+    Base class for serial port stand-ins (see simulator.SimulatedReader and
+    capture.ReplayTransport). Subclasses queue the replies with _queue(),
+    and each reply becomes readable once its time has come.
+    """
+
+    def __init__(self):
+        self._pending = deque()     # (time available, bytes)
+        self._buffer = bytearray()
+
+    def _queue(self, data, available=None):
+        # Makes `data` readable at monotonic time `available` (default: now)
+        self._pending.append((monotonic() if available is None else available, data))
+
+    def _deliver(self):
+        if self._pending:
+            now = monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                self._buffer += self._pending.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        self._deliver()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        self._deliver()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readall(self):
+        self._pending, pending = deque(), self._pending
+        for _, data in pending:
+            self._buffer += data
+        data = bytes(self._buffer)
+        del self._buffer[:]
+        return data
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+        del self._buffer[:]
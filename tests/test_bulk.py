@@ -0,0 +1,79 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Tests for the bulk pre-encoder.
+
+import binascii
+import csv
+import io
+import json
+
+import pytest
+
+from rfidgeek import danish
+from rfidgeek.bulk import validate, encode_chunk, main
+
+
+def test_validate():
+    record = validate({'id': ' 123456789 ', 'isil': 'NO-1030310', 'partno': '2', 'nparts': '3'})
+    assert record == danish.DanishRecord('123456789', 'NO', '1030310', 2, 3)
+
+
+def test_validate_converts_numeric_ids():
+    record = validate({'id': 12345, 'country': 'NO', 'library': 1030310})
+    assert record.id == '12345'
+    assert record.library == '1030310'
+
+
+@pytest.mark.parametrize('item', [
+    ['a'],
+    'a',
+    {'id': ['a'], 'isil': 'NO-1030310'},
+    {'id': {'a': 1}, 'isil': 'NO-1030310'},
+    {'id': True, 'isil': 'NO-1030310'},
+    {'id': '1', 'isil': 7},
+    {'id': '', 'isil': 'NO-1030310'},
+    {'id': '1' * 17, 'isil': 'NO-1030310'},
+    {'id': '1', 'isil': 'no-1030310'},
+    {'id': '1', 'country': 'NO'},
+    {'id': '1', 'isil': 'NO-1030310', 'partno': 4, 'nparts': 3},
+    {'id': '1', 'isil': 'NO-1030310', 'nparts': 'x'},
+])
+def test_validate_rejects_bad_items(item):
+    with pytest.raises(ValueError):
+        validate(item)
+
+
+def test_encode_chunk():
+    items = [(2, {'id': '1', 'isil': 'NO-1030310'}),
+             (3, {'id': 2}),
+             (4, ['not', 'an', 'object']),
+             (5, {'id': 3, 'isil': 'NO-1030310'})]
+    results = encode_chunk(items)
+    assert [r[0] for r in results] == [2, 3, 4, 5]
+    assert [r[3] is None for r in results] == [True, False, False, True]
+    assert danish.decode(results[0][2]).id == '1'
+    assert danish.decode(results[3][2]).id == '3'
+    assert danish.decode(results[3][2]).crc_ok
+
+
+def test_main_reports_bad_rows(tmp_path):
+    lines = [{'id': 1, 'isil': 'NO-1030310'},
+             {'id': '2', 'isil': 'NO-1030310', 'partno': 2, 'nparts': 2},
+             ['a'],
+             {'id': None, 'isil': 'NO-1030310'}]
+    source = tmp_path / 'items.jsonl'
+    source.write_text(u'\n'.join(json.dumps(line) for line in lines) + u'\n{broken\n')
+    output = tmp_path / 'images.csv'
+    errors = tmp_path / 'errors.csv'
+
+    assert main([str(source), '-o', str(output), '--errors', str(errors), '--processes', '1']) == 1
+
+    with io.open(str(output), newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['id'], row['partno'], row['nparts']) for row in rows] == [('1', '1', '1'), ('2', '2', '2')]
+    assert danish.decode(binascii.unhexlify(rows[1]['image'])).partno == 2
+
+    with io.open(str(errors), newline='') as f:
+        bad = list(csv.DictReader(f))
+    assert [row['line'] for row in bad] == ['3', '4', '5']
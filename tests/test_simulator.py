@@ -0,0 +1,157 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: nil; c-basic-offset: 4 -*-
+# vim:fenc=utf-8:et:sw=4:ts=4:sts=4:tw=0
+#
+# Tests running PyRFIDGeek against the simulated EVM board.
+
+import pytest
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from rfidgeek import (PyRFIDGeek, ISO15693, AFI_SECURED, AFI_UNSECURED, PresenceTracker, PartAggregator,
+                      COMPLETE, DEPARTED)
+from rfidgeek.simulator import (SimulatedReader, SimulatedTag, make_population, danish_model_memory,
+                                QUIET, READY)
+
+ITEM = {'id': '123456789', 'partno': 1, 'nparts': 1, 'country': 'NO', 'library': '1030310'}
+
+
+def connect(tags, **kwargs):
+    sim = SimulatedReader(tags, seed=1, **kwargs)
+    rfid = PyRFIDGeek(serial_port=None, transport=sim)
+    rfid.set_protocol(ISO15693)
+    return sim, rfid
+
+
+@pytest.fixture
+def tags():
+    return make_population(30, seed=1)
+
+
+def test_inventory_single_round_loses_colliding_tags(tags):
+    sim, rfid = connect(tags)
+    found = set(rfid.inventory())
+    assert found < set(tag.uid for tag in tags)
+    assert rfid.inventory_stats['collisions'] > 0
+
+
+def test_inventory_anticollision_finds_all_tags(tags):
+    sim, rfid = connect(tags)
+    assert set(rfid.inventory(anticollision=True)) == set(tag.uid for tag in tags)
+    assert rfid.inventory_stats['tags'] == len(tags)
+
+
+def test_inventory_mask(tags):
+    sim, rfid = connect(tags)
+    uid = tags[0].uid
+    mask = int(uid, 16) & 0xffff
+    assert uid in rfid.inventory(anticollision=True, mask=mask, mask_length=16)
+
+
+def test_stay_quiet(tags):
+    sim, rfid = connect(tags)
+    uid = tags[0].uid
+    started = monotonic()
+    rfid.stay_quiet(uid)
+    assert monotonic() - started < rfid.timeout
+    assert tags[0].state == QUIET
+    assert uid not in rfid.inventory(anticollision=True)
+    assert rfid.reset_to_ready(uid)
+    assert uid in rfid.inventory(anticollision=True)
+
+
+def test_quiet_session_resets_quieted_tags(tags):
+    sim, rfid = connect(tags)
+    with rfid.quiet_session():
+        read = list(rfid.inventory(anticollision=True))[:10]
+        for uid in read:
+            assert not rfid.read_danish_model_tag(uid)['error']
+        remaining = set(rfid.inventory(anticollision=True))
+        assert remaining == set(tag.uid for tag in tags) - set(read)
+    assert all(tag.state == READY for tag in tags)
+    assert not rfid.quieted_uids
+    assert len(set(rfid.inventory(anticollision=True))) == len(tags)
+
+
+def test_write_and_read_back():
+    tag = SimulatedTag('E004010012345678')
+    sim, rfid = connect([tag])
+    assert rfid.write_danish_model_tag(tag.uid, ITEM)
+    item = rfid.read_danish_model_tag(tag.uid)
+    assert item['id'] == ITEM['id']
+    assert item['crc_ok']
+
+
+def test_write_falls_back_to_single_blocks():
+    tag = SimulatedTag('E004010012345678', write_multiple=False)
+    sim, rfid = connect([tag])
+    assert rfid.write_danish_model_tag(tag.uid, ITEM, max_attempts=2)
+    assert rfid.read_danish_model_tag(tag.uid)['id'] == ITEM['id']
+
+
+def test_write_retries_failed_blocks():
+    tag = SimulatedTag('E004010012345678', write_multiple=False)
+    sim, rfid = connect([tag], write_failure_rate=0.3)
+    assert rfid.write_danish_model_tag(tag.uid, ITEM, max_attempts=20)
+    assert rfid.read_danish_model_tag(tag.uid)['id'] == ITEM['id']
+
+
+def test_afi_batch_and_filtered_inventory(tags):
+    sim, rfid = connect(tags)
+    secured = [tag.uid for tag in tags[:5]]
+    results = rfid.write_afi_batch(AFI_SECURED, secured)
+    assert all(results.values())
+    assert set(rfid.inventory(anticollision=True, afi=AFI_SECURED)) == set(secured)
+
+    results = rfid.write_afi_batch(AFI_UNSECURED, secured, verify='inventory')
+    assert all(results.values())
+    assert not list(rfid.inventory(anticollision=True, afi=AFI_SECURED))
+
+
+def test_part_aggregator_keeps_known_tags_quiet_until_complete():
+    parts = [SimulatedTag('E0040100000000%02X' % i, memory=danish_model_memory('ITEM1', i, 3))
+             for i in (1, 2, 3)]
+    sim, rfid = connect(parts[:2] + make_population(3, seed=2))
+    presence = PresenceTracker(rfid)
+    aggregator = PartAggregator(rfid, max_wait=10.0, retries=5)
+
+    aggregator.update(presence.poll())
+    assert set(rfid.quieted_uids) == set(tag.uid for tag in sim.tags)
+
+    # Retries only cost the presence and the targeted inventory
+    frames = sim.frames
+    assert aggregator.update(presence.poll()) == []
+    assert sim.frames - frames == 2
+    assert len(presence) == 5
+
+    sim.tags.append(parts[2])
+    events = aggregator.update(presence.poll())
+    assert [(e.event, e.item_id) for e in events] == [(COMPLETE, 'ITEM1')]
+    assert not rfid.quieted_uids
+    assert all(tag.state == READY for tag in sim.tags)
+
+
+@pytest.mark.parametrize('retries', [3, 100])
+def test_tag_leaving_while_quiet_departs(retries):
+    parts = [SimulatedTag('E0040100000000%02X' % i, memory=danish_model_memory('ITEM1', i, 3))
+             for i in (1, 2, 3)]
+    singles = make_population(2, seed=3)
+    sim, rfid = connect(parts[:2] + singles)
+    presence = PresenceTracker(rfid)
+    aggregator = PartAggregator(rfid, max_wait=100.0, retries=retries)
+
+    aggregator.update(presence.poll())
+    assert singles[0].uid in rfid.quieted_uids
+    sim.tags.remove(singles[0])
+    departed = []
+    for i in range(10):
+        events = presence.poll()
+        departed.extend(e.uid for e in events if e.event == DEPARTED)
+        aggregator.update(events)
+    assert departed == [singles[0].uid]
+    assert singles[0].uid not in presence
+    assert singles[0].uid not in rfid.quieted_uids
+    assert singles[1].uid in presence
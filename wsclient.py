@@ -8,9 +8,11 @@ import websocket
 import argparse
 import yaml
 import time
-from copy import copy
 
 from pyrfidgeek import PyRFIDGeek
+from pyrfidgeek.presence import PresenceTracker, ARRIVED, DEPARTED
+from pyrfidgeek.scheduler import CommandScheduler, PRIORITY_USER, PRIORITY_BACKGROUND
+from pyrfidgeek.polling import AdaptivePoller
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -19,6 +21,10 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
+# Frames are only formatted for logging if DEBUG is enabled for the
+# library, so keep it at INFO as long as the handler drops DEBUG anyway
+logging.getLogger('pyrfidgeek').setLevel(logging.INFO)
+
 parser = argparse.ArgumentParser(description='PyRfidGeek reader example')
 parser.add_argument('--config', nargs='?', default='config.yml',
                     help='Config file')
@@ -98,8 +104,13 @@ class ScannerThread(threading.Thread):
 
         try:
 
-            uids = {}
-            prev_uids = [{}, {}]
+            # Tags must miss two polls in a row before they're considered
+            # gone, so tags that miss a single poll aren't announced again
+            presence = PresenceTracker(rfid, max_misses=2)
+
+            # Item ids of the tags present, so that multi-part items are
+            # only announced once
+            item_ids = {}
 
             logger.info('Scanning for tags')
 
@@ -119,52 +130,49 @@ class ScannerThread(threading.Thread):
                         logger.info('Continuing inventory scan')
                     print self, 'received a message', data
 
-                uids = {}
                 if not self.paused:
                     self.scanning = True
-                    for uid in rfid.inventory():
-                        uids[uid] = 'unknown'
-                        if uid in prev_uids[0]:
-                            uids[uid] = prev_uids[0][uid]
-                        elif uid in prev_uids[1]:
-                            uids[uid] = prev_uids[1][uid]
-
-                    for uid, oid in uids.items():
-
-                        if oid == 'unknown':
-                            # if not uid in prev_uids[0] and not uid in prev_uids[1]:
-                            item = rfid.read_danish_model_tag(uid)
-                            if item['error'] != '':
-                                # logger.warn(item['error'])
-                                pass
-                            else:
-
-                                if item['is_blank']:
-                                    logger.info('Blank tag found')
-                                    ws.send(json.dumps({
-                                        'rcpt': 'frontend',
-                                        'msg': 'new-tag',
-                                        'item': item,
-                                        'uid': uid
-                                    }))
-                                    uids[uid] = 'blank'
-
-                                elif 'id' in item:
-                                    oid = item['id']
-                                    if oid not in uids.values():
-                                        logger.info('Tag found of type %s: %s' % (item['usage_type'], item['id']))
-                                        ws.send(json.dumps({
-                                            'rcpt': 'frontend',
-                                            'msg': 'new-tag',
-                                            'item': item,
-                                            'uid': uid
-                                        }))
-                                    uids[uid] = oid
-
-                    prev_uids[1] = copy(prev_uids[0])
-                    prev_uids[0] = copy(uids)
+                    with scheduler.priority(PRIORITY_BACKGROUND):
+                        events = presence.poll()
+                    poller.update(bool(events), present=len(presence) > 0)
+                    for event in events:
+                        uid = event.uid
+                        if event.event == DEPARTED:
+                            item_ids.pop(uid, None)
+                            continue
+                        if event.event != ARRIVED:
+                            continue
+
+                        # Tags flickering at the edge of the field are
+                        # served from the reader's tag cache
+                        item = rfid.read_danish_model_tag(uid, cached=True)
+                        if item['error'] != '':
+                            # logger.warn(item['error'])
+                            # Try again on the next poll
+                            presence.forget(uid)
+                            continue
+
+                        if item['is_blank']:
+                            logger.info('Blank tag found')
+                            ws.send(json.dumps({
+                                'rcpt': 'frontend',
+                                'msg': 'new-tag',
+                                'item': item,
+                                'uid': uid
+                            }))
+
+                        elif 'id' in item:
+                            if item['id'] not in item_ids.values():
+                                logger.info('Tag found of type %s: %s' % (item['usage_type'], item['id']))
+                                ws.send(json.dumps({
+                                    'rcpt': 'frontend',
+                                    'msg': 'new-tag',
+                                    'item': item,
+                                    'uid': uid
+                                }))
+                            item_ids[uid] = item['id']
                 self.scanning = False
-                time.sleep(0.5)
+                poller.wait()
 
         finally:
             print "Thread is exiting..."
@@ -177,6 +185,10 @@ class ScannerThread(threading.Thread):
 
 
 rfid = PyRFIDGeek(config)
+scheduler = CommandScheduler(rfid)
+
+# Polls fast while tags come and go, slowly while the pad is idle
+poller = AdaptivePoller(min_interval=0.1, max_interval=2.0)
 
 
 class WsSock(object):
@@ -221,21 +233,6 @@ class WsSock(object):
 
         user_id = str(message['data']['user_id'])
         logger.info('Got patron card write request from ws frontend client, user id: %s ' % user_id)
-        queue = active_queues[0]
-
-        # Tell inventory scan thread to pause (while writing)
-        queue.put('pause')
-
-        time.sleep(0.5)
-
-        if not self.mailbox.empty():
-            data = self.mailbox.get()
-            if data == 'paused':
-                logger.info('Inventory scan thread paused')
-
-        # scanner.on('paused', function () {
-        # if message['msg'] == 'write-patron-card':
-        #     self.scanner.pause()
 
         ws.send(json.dumps({
             'rcpt': 'frontend',
@@ -243,16 +240,20 @@ class WsSock(object):
             'uid': message['uid']
         }))
 
-        rfid.enable_led(5)
-        rfid.write_danish_model_patron_card(message['uid'], {
-            'user_id': user_id,
-            'library': '1030310',
-            'country': 'NO'
-        })
-        rfid.disable_led(5)
+        # The write gets the reader as soon as the scanner's current frame is
+        # done, and the scanner waits until the write has been verified.
+        with scheduler.transaction(PRIORITY_USER):
+            rfid.enable_led(5)
+            rfid.write_danish_model_patron_card(message['uid'], {
+                'user_id': user_id,
+                'library': '1030310',
+                'country': 'NO'
+            })
+            rfid.disable_led(5)
+
+        # Pick up the changes right away
+        poller.wake()
 
-        # Tell inventory scan thread to continue
-        queue.put('cont')
         self.ws.send(json.dumps({
             'rcpt': 'frontend',
             'msg': 'card-written',